@@ -20,19 +20,54 @@ class Config:
     HOST = os.getenv('EVOSSEARCH_HOST', '0.0.0.0')  # 0.0.0.0 allows network access
     PORT = int(os.getenv('EVOSSEARCH_PORT', '5000'))
     DEBUG = os.getenv('EVOSSEARCH_DEBUG', 'False').lower() in ('true', '1', 'yes', 'on')
+    SERVER_THREADS = int(os.getenv('EVOSSEARCH_SERVER_THREADS', '16'))  # Request threads when served by waitress
     
     # CLIP model configuration
     CLIP_MODEL = os.getenv('EVOSSEARCH_CLIP_MODEL', 'ViT-B/32')
+    CLIP_DEVICE = os.getenv('EVOSSEARCH_CLIP_DEVICE', 'auto').lower()  # 'auto' (CUDA if available), 'cuda' or 'cpu'
+    USE_FP16 = os.getenv('EVOSSEARCH_USE_FP16', 'True').lower() in ('true', '1', 'yes', 'on')  # Half precision on CUDA
+    CPU_INT8 = os.getenv('EVOSSEARCH_CPU_INT8', 'False').lower() in ('true', '1', 'yes', 'on')  # Dynamic int8 quantization on CPU
+    CPU_BF16 = os.getenv('EVOSSEARCH_CPU_BF16', 'False').lower() in ('true', '1', 'yes', 'on')  # BF16 autocast on CPU
+    USE_ONNX = os.getenv('EVOSSEARCH_USE_ONNX', 'False').lower() in ('true', '1', 'yes', 'on')  # ONNX Runtime encoders if installed
+    TORCH_COMPILE = os.getenv('EVOSSEARCH_TORCH_COMPILE', 'False').lower() in ('true', '1', 'yes', 'on')
     
     # Search result limits
     MIN_RESULTS = int(os.getenv('EVOSSEARCH_MIN_RESULTS', '3'))
     MAX_RESULTS = int(os.getenv('EVOSSEARCH_MAX_RESULTS', '48'))
     DEFAULT_RESULTS = int(os.getenv('EVOSSEARCH_DEFAULT_RESULTS', '12'))
+    TEXT_CACHE_SIZE = int(os.getenv('EVOSSEARCH_TEXT_CACHE_SIZE', '1024'))  # Cached text query embeddings
+    TEXT_BATCH_SIZE = int(os.getenv('EVOSSEARCH_TEXT_BATCH_SIZE', '32'))  # Max text queries per CLIP forward
+    TEXT_BATCH_WAIT_MS = float(os.getenv('EVOSSEARCH_TEXT_BATCH_WAIT_MS', '10'))  # Wait to fill a text batch
+    SEARCH_BATCH_SIZE = int(os.getenv('EVOSSEARCH_SEARCH_BATCH_SIZE', '32'))  # Max queries per FAISS search call
+    SEARCH_BATCH_WAIT_MS = float(os.getenv('EVOSSEARCH_SEARCH_BATCH_WAIT_MS', '2'))  # Wait to fill a search batch
+    FAISS_SEARCH_THREADS = int(os.getenv('EVOSSEARCH_FAISS_SEARCH_THREADS', str(max(1, (os.cpu_count() or 2) // 2))))  # OpenMP threads per search batch (0: FAISS default)
+    TIME_SORT_POOL_FACTOR = int(os.getenv('EVOSSEARCH_TIME_SORT_POOL_FACTOR', '5'))  # Time sort: newest of k * this many matches
+    
+    # FAISS index configuration
+    ANN_THRESHOLD = int(os.getenv('EVOSSEARCH_ANN_THRESHOLD', '50000'))  # Exact search below this many images
+    ANN_INDEX_TYPE = os.getenv('EVOSSEARCH_ANN_INDEX_TYPE', 'ivfpq').lower()  # 'ivfpq' or 'hnsw'
+    FLAT_INDEX_8BIT = os.getenv('EVOSSEARCH_FLAT_INDEX_8BIT', 'False').lower() in ('true', '1', 'yes', 'on')  # 8-bit codes + exact re-rank (overrides FP16)
+    FLAT_INDEX_FP16 = os.getenv('EVOSSEARCH_FLAT_INDEX_FP16', 'True').lower() in ('true', '1', 'yes', 'on')  # FP16 storage for exact search and HNSW
+    DUPLICATE_THRESHOLD = float(os.getenv('EVOSSEARCH_DUPLICATE_THRESHOLD', '0.98'))  # Cosine similarity for near-duplicates (0 disables)
+    NPROBE = int(os.getenv('EVOSSEARCH_NPROBE', '16'))  # IVF lists visited per query
+    RERANK_FACTOR = int(os.getenv('EVOSSEARCH_RERANK_FACTOR', '4'))  # IVFPQ/8-bit candidates re-scored exactly per result (1 disables)
+    HNSW_EF_CONSTRUCTION = int(os.getenv('EVOSSEARCH_HNSW_EF_CONSTRUCTION', '200'))  # HNSW candidate list size while building
+    HNSW_EF_SEARCH = int(os.getenv('EVOSSEARCH_HNSW_EF_SEARCH', '64'))  # HNSW candidate list size per query (at least 2x the results fetched)
+    INDEX_CACHE_SIZE = int(os.getenv('EVOSSEARCH_INDEX_CACHE_SIZE', '8'))  # Loaded folder indexes kept in memory
+    PRELOAD_FOLDERS = [f for f in os.getenv('EVOSSEARCH_PRELOAD_FOLDERS', '').split(os.pathsep) if f]  # Indexed folders loaded at startup
+    FAISS_GPU = os.getenv('EVOSSEARCH_FAISS_GPU', 'True').lower() in ('true', '1', 'yes', 'on')  # Search on GPU with faiss-gpu
+    FAISS_GPU_MIN_SIZE = int(os.getenv('EVOSSEARCH_FAISS_GPU_MIN_SIZE', '10000'))  # Smaller indexes stay on the CPU
     
     # Processing configuration
     BATCH_SIZE = int(os.getenv('EVOSSEARCH_BATCH_SIZE', '32'))
+    NUM_WORKERS = int(os.getenv('EVOSSEARCH_NUM_WORKERS', str((os.cpu_count() or 2) // 2)))  # DataLoader decode workers
+    PREFETCH_BATCHES = int(os.getenv('EVOSSEARCH_PREFETCH_BATCHES', '4'))  # Decoded batches queued ahead of the encoder
+    USE_DALI = os.getenv('EVOSSEARCH_USE_DALI', 'True').lower() in ('true', '1', 'yes', 'on')  # GPU JPEG decoding if installed
+    USE_NVJPEG = os.getenv('EVOSSEARCH_USE_NVJPEG', 'True').lower() in ('true', '1', 'yes', 'on')  # torchvision GPU JPEG decoding without DALI
     THUMBNAIL_SIZE = (400, 400)
     THUMBNAIL_QUALITY = int(os.getenv('EVOSSEARCH_THUMBNAIL_QUALITY', '85'))
+    THUMBNAIL_FORMAT = os.getenv('EVOSSEARCH_THUMBNAIL_FORMAT', 'jpeg').lower()  # 'jpeg' or 'webp' (smaller, slower to encode)
+    THUMBNAIL_WORKERS = int(os.getenv('EVOSSEARCH_THUMBNAIL_WORKERS', str(os.cpu_count() or 8)))  # Parallel thumbnail encoders, per pool (indexing; missing result thumbnails)
     
     # File system configuration
     INDEX_FOLDER_NAME = os.getenv('EVOSSEARCH_INDEX_FOLDER', '.clip_index')
@@ -1,226 +1,1894 @@
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 import pickle
+import json
+import mmap
+import math
+import stat
+import contextlib
+import shutil
+import functools
+import weakref
 import numpy as np
-from flask import Flask, request, jsonify, send_file, render_template_string, make_response
+from flask import Flask, Response, request, jsonify, send_file, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.http import is_resource_modified
 import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader, default_collate
 import clip
 import faiss
-from PIL import Image
+from PIL import Image, features as pil_features
+import PIL
 from pathlib import Path
-import base64
+import hashlib
+import gzip
 from io import BytesIO
 from config import config
 import time
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, Future
+import queue
+import threading
+from collections import OrderedDict
+
+try:
+    from nvidia.dali import pipeline_def, fn, types
+    from nvidia.dali.plugin.pytorch import DALIGenericIterator, LastBatchPolicy
+except ImportError:
+    # NVIDIA DALI not installed, JPEGs are decoded on the CPU by the DataLoader
+    pipeline_def = None
+
+try:
+    from torchvision.io import decode_jpeg, read_file, ImageReadMode
+except ImportError:
+    # torchvision too old for batched nvJPEG decoding, JPEGs are decoded on the CPU without DALI
+    decode_jpeg = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    # ONNX Runtime not installed, CLIP always runs in PyTorch
+    ort = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow not installed, image metadata is pickled
+    pq = None
+
+try:
+    import orjson
+except ImportError:
+    # orjson not installed, comments and responses are serialized with the json module
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    # brotli not installed, the frontend is served gzip-compressed only
+    brotli = None
+
+try:
+    import waitress
+except ImportError:
+    # waitress not installed, python oldapp.py serves with Flask's threaded development server
+    waitress = None
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    # PyTurboJPEG or libjpeg-turbo not installed, JPEGs are decoded and thumbnails encoded with PIL
+    turbo_jpeg = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify through orjson when it is installed, several times faster on result lists"""
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            try:
+                # Datetimes still go through Flask's default (HTTP dates), as with the json module
+                options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+                return orjson.dumps(obj, default=self.default, option=options).decode('utf-8')
+            except TypeError:
+                pass  # e.g. an undecodable filename (surrogateescape); the json module escapes it
+        return super().dumps(obj, **kwargs)
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_FILE_SIZE_MB * 1024 * 1024  # larger uploads are refused before they are read
 CORS(app)
 
 # Global variables
 model = None
 preprocess = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
+faiss_res = None
+faiss_gpu_lock = threading.Lock()
+text_queue = queue.Queue()
+text_worker = None
+search_queue = queue.Queue()
+search_worker = None
+query_buffers = queue.SimpleQueue()  # free pinned host buffers for single-image queries
+compiled = False  # CLIP towers run through torch.compile
+onnx_sessions = {}  # 'encode_image' / 'encode_text' -> ONNX Runtime session replacing that CLIP tower
+image_batch_limit = None  # largest image batch that fit on the GPU after an out-of-memory error (None: BATCH_SIZE fits)
+index_cache = OrderedDict()  # folder key -> (index.faiss mtime, index, image paths, metadata), least recently used first
+index_cache_lock = threading.Lock()  # held only to read and update the caches, never across file or GPU work
+folder_locks = weakref.WeakValueDictionary()  # folder key -> RLock serializing one folder's index loads, saves and thumbnail swaps, while in use
+embeddings_cache = OrderedDict()  # folder key -> (embeddings.npy mtime, memory-mapped FP16 embeddings), under index_cache_lock
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+index_jobs = {}  # folder key -> pending indexing Future
+index_load_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-load')  # indexes warmed by /check_index
+index_jobs_lock = threading.Lock()
+thumb_folders = {}  # thumbnail URL token -> indexed folder
+pending_thumbnails = {}  # thumbnail path -> Future of its rebuild_thumbnail job
+thumbnail_sources = OrderedDict()  # thumbnail path -> (image path, mtime, size) it was rebuilt from, least recently rebuilt first
+pending_thumbnails_lock = threading.Lock()
+comments_cache = OrderedDict()  # folder key -> [comments dict, lines in comments.jsonl, file signature], least recently used first
+comments_lock = threading.Lock()
+
+def select_device(requested):
+    """Device CLIP runs on: CUDA when available, unless EVOSSEARCH_CLIP_DEVICE asks for the CPU"""
+    if requested == 'cpu':
+        return 'cpu'
+    if torch.cuda.is_available():
+        return 'cuda'
+    if requested == 'cuda':
+        logger.warning("EVOSSEARCH_CLIP_DEVICE=cuda but no CUDA device is available, running CLIP on CPU")
+    return 'cpu'
+
+device = select_device(config.CLIP_DEVICE)
+
+# CLIP preprocessing constants (see clip.clip._transform)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+JPEG_EXTENSIONS = {'.jpg', '.jpeg'}
+THUMBNAIL_EXTENSION = '.webp' if config.THUMBNAIL_FORMAT == 'webp' else '.jpg'
+COMMENT_LOG_COMPACT_LINES = 100  # Appended comments before comments.jsonl is folded into comments.json (at least one per commented image)
+IVFPQ_MIN_TRAINING = 39 * 256  # FAISS wants ~39 training points per PQ centroid
+# Memory-map index files (and IndexFlatCodes, the exact and HNSW storage): loading is instant and pages are shared
+# through the page cache. Not on Windows, where a mapped file could not be replaced while a request still holds it
+MMAP_INDEX_FILES = os.name != 'nt'
+INDEX_READ_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', 0) if MMAP_INDEX_FILES else 0
+PARALLEL_STAT_MIN_FILES = 256  # Folders with this many images stat them from a thread pool (outside Windows)
+PARALLEL_STAT_WORKERS = 16
+THUMBNAIL_SOURCES_SIZE = 10000  # Rebuilt thumbnails whose source is remembered; a forgotten one is rebuilt again
+
+# Shared pool so index thumbnails are encoded in parallel (PIL and libjpeg-turbo release the GIL, so threads scale)
+thumbnail_executor = ThreadPoolExecutor(max_workers=config.THUMBNAIL_WORKERS)
+# Thumbnails a search result is waiting for; a pool of their own so they never queue behind a whole folder being indexed
+result_thumbnail_executor = ThreadPoolExecutor(max_workers=config.THUMBNAIL_WORKERS)
 
 def init_clip():
     """Initialize CLIP model"""
-    global model, preprocess
+    global model, preprocess, faiss_res, text_worker, search_worker, compiled, image_batch_limit
     model, preprocess = clip.load(config.CLIP_MODEL, device=device)
+    model.eval()
+    clip.model.ResidualAttentionBlock.attention = sdpa_attention
+    encode_text_query.cache_clear()
+    onnx_sessions.clear()
+    compiled = False
+    image_batch_limit = None
+    
+    # GPU resources are only available with the faiss-gpu build
+    if config.FAISS_GPU and device == 'cuda' and hasattr(faiss, 'StandardGpuResources') and faiss.get_num_gpus() > 0:
+        faiss_res = faiss.StandardGpuResources()
+    
+    # clip.load keeps FP16 weights on CUDA and FP32 on CPU
+    if device == 'cuda' and not config.USE_FP16:
+        model.float()
+        # FP32 weights still get tensor cores (Ampere+) through TF32 matmuls/convolutions
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+    
+    # Int8 weights for the transformer MLPs/projections (VNNI/AVX-512 matmuls on CPU)
+    if device == 'cpu' and config.CPU_INT8:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    if config.USE_ONNX and ort is not None and not config.CPU_INT8:
+        for tower in ('encode_image', 'encode_text'):
+            try:
+                onnx_sessions[tower] = load_onnx_session(tower)
+            except Exception:
+                logger.exception("ONNX export of %s failed, running it in PyTorch", tower)
+    elif config.TORCH_COMPILE:
+        if device == 'cuda':
+            torch.backends.cudnn.benchmark = True
+        mode = 'reduce-overhead' if device == 'cuda' else 'default'
+        # Compile the towers rather than the wrapper so encode_image/encode_text pick them up
+        visual, transformer = model.visual, model.transformer
+        model.visual = torch.compile(visual, mode=mode, dynamic=False)
+        model.transformer = torch.compile(transformer, mode=mode, dynamic=False)
+        compiled = True
+        
+        # Pay the compilation cost at startup for every batch shape the encoders will see
+        resolution = visual.input_resolution
+        try:
+            with torch.inference_mode(), autocast_context():
+                for size in sorted({1, config.BATCH_SIZE}):
+                    model.encode_image(torch.zeros(size, 3, resolution, resolution, device=device, dtype=model.dtype))
+                size = 1
+                while True:
+                    model.encode_text(clip.tokenize(["warmup"] * size).to(device))
+                    if size >= config.TEXT_BATCH_SIZE:
+                        break
+                    size *= 2
+        except Exception as e:
+            # e.g. no C++ compiler or Triton on this machine
+            logger.warning("torch.compile failed, running CLIP eagerly: %s", e)
+            model.visual, model.transformer = visual, transformer
+            compiled = False
+    
+    if not compiled:
+        # One forward per tower so cuDNN/cuBLAS setup and ONNX Runtime's first run happen before any request
+        try:
+            resolution = model.visual.input_resolution
+            with torch.inference_mode(), autocast_context():
+                run_tower('encode_image', torch.zeros(1, 3, resolution, resolution, device=device, dtype=model.dtype))
+                run_tower('encode_text', clip.tokenize(["warmup"]).to(device))
+        except Exception:
+            logger.exception("CLIP warmup failed")
+    
+    # Concurrent text searches share CLIP forwards through the batch worker
+    if text_worker is None:
+        text_worker = threading.Thread(target=text_batch_worker, daemon=True)
+        text_worker.start()
+    
+    # ...and FAISS searches through the search worker
+    if search_worker is None:
+        search_worker = threading.Thread(target=search_batch_worker, daemon=True)
+        search_worker.start()
+    
+    if config.PRELOAD_FOLDERS:
+        threading.Thread(target=preload_folders, args=(config.PRELOAD_FOLDERS,), daemon=True, name='preload').start()
+
+def preload_folders(folders):
+    """Load indexes at startup so the first search of each folder doesn't pay for reading it"""
+    for folder in folders:
+        try:
+            index, image_paths, _ = load_index(folder)
+            if index is None:
+                logger.warning("Preload: %s is not indexed", folder)
+                continue
+            load_embeddings(folder)
+            image_paths.build_lookup()  # used by find-similar and comments
+            # One search faults in the index and starts FAISS's OpenMP threads on the search worker
+            search_index(index, np.zeros(index.d, dtype=np.float32), 1)
+            logger.info("Preloaded %s (%d images)", folder, len(image_paths))
+        except Exception:
+            logger.exception("Preloading %s failed", folder)
+
+class ClipTower(torch.nn.Module):
+    """One CLIP encoder as a standalone module for ONNX export"""
+    def __init__(self, clip_model, tower):
+        super().__init__()
+        self.clip_model = clip_model
+        self.tower = tower
+    
+    def forward(self, x):
+        return getattr(self.clip_model, self.tower)(x)
+
+def load_onnx_session(tower):
+    """Export a CLIP tower to ONNX once (cached per model and dtype) and open it in ONNX Runtime"""
+    dtype = str(model.dtype).replace('torch.', '')
+    onnx_path = Path.home() / '.cache' / 'evo-ssearch' / f"{config.CLIP_MODEL.replace('/', '-')}-{tower}-{dtype}.onnx"
+    if not onnx_path.exists():
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        if tower == 'encode_image':
+            resolution = model.visual.input_resolution
+            example = torch.zeros(1, 3, resolution, resolution, device=device, dtype=model.dtype)
+        else:
+            example = clip.tokenize(["export"]).to(device)
+        tmp_path = onnx_path.with_name(onnx_path.name + '.tmp')
+        torch.onnx.export(ClipTower(model, tower), (example,), str(tmp_path), opset_version=17,
+                          input_names=['x'], output_names=['features'], dynamic_axes={'x': {0: 'batch'}, 'features': {0: 'batch'}})
+        os.replace(tmp_path, onnx_path)
+    
+    providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == 'cuda' else ['CPUExecutionProvider']
+    return ort.InferenceSession(str(onnx_path), providers=providers)
+
+def run_tower(tower, x):
+    """CLIP features for a batch, through ONNX Runtime when that tower was exported"""
+    session = onnx_sessions.get(tower)
+    if session is None:
+        return getattr(model, tower)(x)
+    return torch.from_numpy(session.run(None, {'x': x.cpu().numpy()})[0]).to(x.device)
+
+def sdpa_attention(self, x):
+    """ResidualAttentionBlock.attention through F.scaled_dot_product_attention (FlashAttention kernels on CUDA)
+    
+    CLIP's only attention mask is the text tower's causal mask, so it is passed as
+    is_causal instead of a dense (L, L) mask that would rule out the flash kernel.
+    """
+    attn = self.attn
+    length, batch, width = x.shape
+    heads = attn.num_heads
+    qkv = F.linear(x, attn.in_proj_weight, attn.in_proj_bias)
+    # unbind rather than tuple-unpacking the tensor, which tracing (ONNX export) can't follow
+    q, k, v = qkv.view(length, batch, 3, heads, width // heads).permute(2, 1, 3, 0, 4).unbind(0)
+    out = F.scaled_dot_product_attention(q, k, v, is_causal=self.attn_mask is not None)
+    return attn.out_proj(out.permute(2, 0, 1, 3).reshape(length, batch, width))
+
+def autocast_context():
+    """Mixed precision context for CLIP forward passes"""
+    if device == 'cpu' and config.CPU_BF16:
+        return torch.autocast(device_type='cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
     
 def get_image_embedding(image_path):
     """Extract CLIP embedding from image"""
-    image = preprocess(Image.open(image_path)).unsqueeze(0).to(device)
-    with torch.no_grad():
-        image_features = model.encode_image(image)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-    return image_features.cpu().numpy().flatten()
+    resolution = model.visual.input_resolution
+    return get_image_embedding_from_pil(open_image(image_path, (resolution, resolution)))
 
 def get_image_embedding_from_pil(pil_image):
     """Extract CLIP embedding from PIL Image"""
-    image = preprocess(pil_image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        image_features = model.encode_image(image)
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-    return image_features.cpu().numpy().flatten()
+    # Batch of one built in place in the model dtype, so FP16 models copy half the bytes
+    image = preprocess(pil_image).to(model.dtype)[None]
+    buffer = None
+    if device == 'cuda':
+        # Stage through a reused pinned buffer so the copy is a real async DMA without pinning per query
+        buffer = pinned_query_buffer(image)
+        image = buffer.copy_(image)
+    image = image.to(device, non_blocking=True)
+    with torch.inference_mode(), autocast_context():
+        image_features = run_tower('encode_image', image)
+    # Widen to FP32 after the copy (half the bytes, no extra kernel); normalizing one vector
+    # on the host is cheaper than another kernel before the sync too
+    embedding = image_features.cpu().float().numpy()
+    if buffer is not None:
+        query_buffers.put(buffer)  # the sync above finished the copy out of it
+    faiss.normalize_L2(embedding)
+    return embedding[0]
+
+def pinned_query_buffer(like):
+    """A pinned host tensor shaped like a query batch, reused across requests when one is free"""
+    try:
+        buffer = query_buffers.get_nowait()
+        if buffer.shape == like.shape and buffer.dtype == like.dtype:
+            return buffer
+    except queue.Empty:
+        pass
+    return torch.empty(like.shape, dtype=like.dtype, pin_memory=True)
 
 def get_text_embedding(text):
-    """Extract CLIP embedding from text"""
-    text_tokens = clip.tokenize([text]).to(device)
-    with torch.no_grad():
-        text_features = model.encode_text(text_tokens)
-        text_features /= text_features.norm(dim=-1, keepdim=True)
-    return text_features.cpu().numpy().flatten()
+    """Extract CLIP embedding from text (cached per query string)"""
+    # CLIP's tokenizer lowercases and collapses whitespace, so "Red  car" can share the entry of "red car"
+    return encode_text_query(' '.join(text.split()).lower())
+
+@functools.lru_cache(maxsize=config.TEXT_CACHE_SIZE)
+def encode_text_query(text):
+    """Encode one normalized text query through the text batch worker"""
+    # Tokenize here so a bad query fails its own request, not the whole batch
+    future = Future()
+    text_queue.put((clip.tokenize([text]), future))
+    embedding = future.result()
+    embedding.setflags(write=False)  # shared between callers through the cache
+    return embedding
+
+def get_batch(work_queue, batch_size, wait_ms):
+    """Block for one queued item, then collect up to batch_size items already queued or arriving within wait_ms"""
+    batch = [work_queue.get()]
+    deadline = time.monotonic() + wait_ms / 1000
+    while len(batch) < batch_size:
+        timeout = deadline - time.monotonic()
+        try:
+            batch.append(work_queue.get(timeout=timeout) if timeout > 0 else work_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def batch_wait(previous_batch, wait_ms):
+    """How long to wait for a batch to fill: only while the last one had company, so a lone request at low load isn't delayed"""
+    return wait_ms if len(previous_batch) > 1 else 0
+
+def text_batch_worker():
+    """Encode queued text queries together, one CLIP forward per batch"""
+    batch = []
+    while True:
+        batch = get_batch(text_queue, config.TEXT_BATCH_SIZE, batch_wait(batch, config.TEXT_BATCH_WAIT_MS))
+        
+        futures = [future for _, future in batch]
+        try:
+            text_tokens = torch.cat([tokens for tokens, _ in batch]).to(device)
+            if compiled:
+                # Round up to a power of two, the batch sizes compiled at startup
+                text_tokens = pad_batch(text_tokens, 1 << (len(batch) - 1).bit_length())
+            with torch.inference_mode(), autocast_context():
+                text_features = run_tower('encode_text', text_tokens)[:len(batch)]
+            # FP16/BF16 features cross to the host as is and are widened to FP32 for FAISS there
+            embeddings = np.ascontiguousarray(text_features.cpu().float().numpy())
+            faiss.normalize_L2(embeddings)  # a few query vectors: cheaper on the host than another kernel
+            for future, embedding in zip(futures, embeddings):
+                future.set_result(embedding.copy())
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+
+def open_image(img_path, size, fit=False):
+    """Open an image, decoding JPEGs at the smallest DCT scale that still covers size
+    
+    With fit, size is a box the image is shrunk to fit inside (thumbnails): only the side that
+    ends up touching the box must stay large enough, not both as for CLIP's center crop. For a
+    4:3 photo in a square box that is often half the scale, a quarter of the pixels decoded.
+    """
+    def covers(width, height):
+        if fit:
+            return width >= size[0] or height >= size[1]
+        return width >= size[0] and height >= size[1]
+    
+    if turbo_jpeg is not None and Path(img_path).suffix.lower() in JPEG_EXTENSIONS:
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        try:
+            width, height, _, _ = turbo_jpeg.decode_header(data)
+            scales = [s for s in turbo_jpeg.scaling_factors if covers(width * s[0] / s[1], height * s[0] / s[1])]
+            scale = min(scales, key=lambda s: s[0] / s[1], default=(1, 1))
+            return Image.fromarray(turbo_jpeg.decode(data, pixel_format=TJPF_RGB, scaling_factor=scale))
+        except Exception:
+            # e.g. a mislabeled PNG; PIL sniffs the real format
+            pass
+    
+    image = Image.open(img_path)
+    if fit:
+        # draft() wants both sides covered, so ask for the size the image will actually be shrunk to
+        ratio = min(size[0] / image.width, size[1] / image.height)
+        size = (max(1, math.ceil(image.width * ratio)), max(1, math.ceil(image.height * ratio)))
+    # Let libjpeg decode large JPEGs at a reduced scale
+    image.draft('RGB', size)
+    return image
+
+class ImageDataset(Dataset):
+    """Decode and preprocess images in DataLoader workers"""
+    def __init__(self, image_paths, transform, resolution, dtype):
+        self.image_paths = image_paths
+        self.transform = transform
+        self.resolution = resolution
+        self.dtype = dtype
+    
+    def __len__(self):
+        return len(self.image_paths)
+    
+    def __getitem__(self, i):
+        try:
+            image = open_image(self.image_paths[i], (self.resolution, self.resolution))
+            # Cast to the model dtype here so FP16 batches are half the size to pin and copy
+            return i, self.transform(image.convert('RGB')).to(self.dtype)
+        except Exception as e:
+            logger.warning("Error processing %s: %s", self.image_paths[i], e)
+            return i, None
+
+def init_loader_worker(worker_id):
+    """Keep each DataLoader worker single-threaded so workers don't oversubscribe the CPU"""
+    torch.set_num_threads(1)
+
+def collate_images(batch):
+    """Stack preprocessed images, dropping the ones that failed to load"""
+    batch = [item for item in batch if item[1] is not None]
+    if not batch:
+        return [], None
+    positions, tensors = zip(*batch)
+    # default_collate stacks straight into shared memory inside workers, saving a copy per batch
+    return list(positions), default_collate(tensors)
+
+def pad_batch(batch, size):
+    """Zero-pad a batch along dim 0 so a compiled model sees one of its warmed-up shapes"""
+    if len(batch) >= size:
+        return batch
+    return torch.cat([batch, batch.new_zeros((size - len(batch),) + batch.shape[1:])])
+
+def get_image_embeddings_batch(images, out=None):
+    """Extract CLIP embeddings from a batch of preprocessed images, optionally into an FP16 array slice"""
+    global image_batch_limit
+    n = len(images)
+    limit = image_batch_limit
+    if limit is not None and n > limit:
+        # Split up front rather than failing a full-size forward on every batch
+        parts = [get_image_embeddings_batch(images[i:i + limit], None if out is None else out[i:i + limit])
+                 for i in range(0, n, limit)]
+        return out if out is not None else np.concatenate(parts)
+    
+    images = images.to(device, non_blocking=True)
+    if compiled and n > 1:
+        # The last batch of a folder is usually short; don't recompile for it
+        images = pad_batch(images, limit or config.BATCH_SIZE)
+    try:
+        with torch.inference_mode(), autocast_context():
+            image_features = F.normalize(run_tower('encode_image', images)[:n].float(), dim=-1)
+    except torch.cuda.OutOfMemoryError:
+        if n == 1:
+            raise
+        # BATCH_SIZE is too large for this GPU and model: encode the batch in halves,
+        # and remember the size so later batches don't hit the same error first
+        torch.cuda.empty_cache()
+        half = n // 2
+        image_batch_limit = half if image_batch_limit is None else min(image_batch_limit, half)
+        first = get_image_embeddings_batch(images[:half], None if out is None else out[:half])
+        second = get_image_embeddings_batch(images[half:n], None if out is None else out[half:])
+        return out if out is not None else np.concatenate([first, second])
+    if out is None:
+        return image_features.cpu().numpy()
+    
+    # Cast on the device so only FP16 crosses to the host, straight into the caller's array
+    target = torch.from_numpy(out)
+    target.copy_(image_features.to(target.dtype))
+    return out
+
+def iter_dali_batches(image_paths):
+    """Decode, resize and normalize JPEGs on the GPU with NVIDIA DALI"""
+    resolution = model.visual.input_resolution
+    
+    # Decode as far ahead of the encoder as the CPU path queues batches
+    @pipeline_def(batch_size=config.BATCH_SIZE, num_threads=max(config.NUM_WORKERS, 1),
+                  device_id=torch.cuda.current_device(), prefetch_queue_depth=max(config.PREFETCH_BATCHES, 1))
+    def clip_pipeline():
+        jpegs, labels = fn.readers.file(
+            files=[str(p) for p in image_paths],
+            labels=list(range(len(image_paths))),
+            name='Reader'
+        )
+        images = fn.decoders.image(jpegs, device='mixed', output_type=types.RGB)
+        images = fn.resize(images, resize_shorter=resolution, interp_type=types.INTERP_CUBIC)
+        images = fn.crop_mirror_normalize(
+            images,
+            crop=(resolution, resolution),
+            mean=[m * 255 for m in CLIP_MEAN],
+            std=[s * 255 for s in CLIP_STD],
+            dtype=types.FLOAT16 if model.dtype == torch.float16 else types.FLOAT,
+            output_layout='CHW'
+        )
+        return images, labels
+    
+    pipe = clip_pipeline()
+    pipe.build()
+    iterator = DALIGenericIterator(pipe, ['images', 'labels'], reader_name='Reader',
+                                   last_batch_policy=LastBatchPolicy.PARTIAL)
+    for batch in iterator:
+        yield batch[0]['labels'].flatten().tolist(), batch[0]['images']
+
+def resize_crop_gpu(image, resolution):
+    """CLIP's Resize + CenterCrop for one decoded uint8 CHW tensor, on its device"""
+    _, height, width = image.shape
+    # Shorter side to resolution, like torchvision's Resize on the PIL image
+    if height <= width:
+        size = (resolution, int(resolution * width / height))
+    else:
+        size = (int(resolution * height / width), resolution)
+    image = F.interpolate(image[None].float(), size=size, mode='bicubic', antialias=True, align_corners=False)[0]
+    top = (size[0] - resolution) // 2
+    left = (size[1] - resolution) // 2
+    return image[:, top:top + resolution, left:left + resolution].clamp_(0, 255)
+
+def iter_nvjpeg_batches(image_paths):
+    """Decode JPEGs with torchvision's nvJPEG bindings and resize and normalize them on the GPU"""
+    resolution = model.visual.input_resolution
+    mean = torch.tensor(CLIP_MEAN, device=device).view(3, 1, 1) * 255
+    std = torch.tensor(CLIP_STD, device=device).view(3, 1, 1) * 255
+    for start in range(0, len(image_paths), config.BATCH_SIZE):
+        positions, data = [], []
+        for i in range(start, min(start + config.BATCH_SIZE, len(image_paths))):
+            try:
+                data.append(read_file(str(image_paths[i])))
+                positions.append(i)
+            except (OSError, RuntimeError):
+                continue
+        try:
+            decoded = decode_jpeg(data, mode=ImageReadMode.RGB, device=device) if data else []
+        except (RuntimeError, TypeError):
+            # e.g. a corrupt or mislabeled file: decode one by one, leaving failures to the CPU decoder
+            decoded = []
+            for i, raw in zip(list(positions), data):
+                try:
+                    decoded.append(decode_jpeg(raw, mode=ImageReadMode.RGB, device=device))
+                except RuntimeError:
+                    positions.remove(i)
+        if not decoded:
+            continue
+        images = torch.stack([resize_crop_gpu(image, resolution) for image in decoded])
+        yield positions, ((images - mean) / std).to(model.dtype)
+
+def iter_image_batches(candidates):
+    """Yield (positions, preprocessed batch) for the candidate image paths"""
+    remaining = list(range(len(candidates)))
+    
+    # JPEGs are decoded on the GPU with DALI, or with torchvision's nvJPEG bindings without it
+    gpu_batches = None
+    if device == 'cuda':
+        if config.USE_DALI and pipeline_def is not None:
+            gpu_batches = iter_dali_batches
+        elif config.USE_NVJPEG and decode_jpeg is not None:
+            gpu_batches = iter_nvjpeg_batches
+    if gpu_batches is not None:
+        jpeg_positions = [i for i in remaining if os.path.splitext(candidates[i])[1].lower() in JPEG_EXTENSIONS]
+        done = set()
+        try:
+            for positions, images in gpu_batches([candidates[i] for i in jpeg_positions]):
+                positions = [jpeg_positions[p] for p in positions]
+                done.update(positions)
+                yield positions, images
+        except Exception as e:
+            # e.g. a corrupt JPEG; the DataLoader handles it per image
+            logger.warning("GPU JPEG decoding failed, falling back to CPU decoding: %s", e)
+        remaining = [i for i in remaining if i not in done]
+    
+    if not remaining:
+        return
+    
+    # Decode + preprocess in worker processes while the model encodes the previous batch;
+    # a re-index with a handful of new images doesn't start workers that would get no batch
+    num_batches = -(-len(remaining) // config.BATCH_SIZE)
+    num_workers = max(min(config.NUM_WORKERS, num_batches), 0)
+    loader_options = {}
+    if num_workers > 0:
+        # Keep at least PREFETCH_BATCHES decoded batches in flight across the workers
+        loader_options['prefetch_factor'] = max(2, -(-config.PREFETCH_BATCHES // num_workers))
+    # No persistent_workers: each indexing run builds its own loader and iterates it once
+    loader = DataLoader(
+        ImageDataset([candidates[i] for i in remaining], preprocess, model.visual.input_resolution, model.dtype),
+        batch_size=config.BATCH_SIZE,
+        num_workers=num_workers,
+        pin_memory=(device == 'cuda'),
+        collate_fn=collate_images,
+        worker_init_fn=init_loader_worker,
+        **loader_options
+    )
+    for positions, images in loader:
+        if images is not None:
+            yield [remaining[p] for p in positions], images
+
+def iter_in_background(iterable, maxsize):
+    """Run an iterator on a producer thread, handing items over through a bounded queue"""
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    finished = object()
+    
+    def put(item):
+        # Give up if the consumer has gone away instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+        put((finished, None))
+    
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        stop.set()
+
+def prefetch_to_device(batches):
+    """Copy the next batch to the GPU on a side stream while the current one is encoded"""
+    if device != 'cuda':
+        yield from batches
+        return
+    
+    def on_compute_stream(positions, images, ready):
+        # Only wait for this batch's copy, not the one queued behind it
+        compute_stream = torch.cuda.current_stream()
+        compute_stream.wait_event(ready)
+        images.record_stream(compute_stream)
+        return positions, images
+    
+    copy_stream = torch.cuda.Stream()
+    pending = None
+    for positions, images in batches:
+        # Pinned host memory makes this copy asynchronous
+        with torch.cuda.stream(copy_stream):
+            images = images.to(device, non_blocking=True)
+            ready = torch.cuda.Event()
+            ready.record(copy_stream)
+        if pending is not None:
+            yield on_compute_stream(*pending)
+        pending = (positions, images, ready)
+    
+    if pending is not None:
+        yield on_compute_stream(*pending)
+
+def stat_image(entry):
+    """(path, stat) for an image DirEntry, or None if it is not a regular file (or vanished)"""
+    try:
+        # DirEntry caches the stat (free on Windows, one call elsewhere)
+        if entry.is_file():
+            return entry.path, entry.stat()
+    except OSError:
+        pass  # removed while scanning
+    return None
+
+def list_images(folder_path):
+    """(path string, stat) of supported image files directly inside a folder, from one directory scan"""
+    extensions = config.SUPPORTED_EXTENSIONS
+    with os.scandir(folder_path) as entries:
+        entries = [entry for entry in entries if os.path.splitext(entry.name)[1].lower() in extensions]
+    
+    if os.name != 'nt' and len(entries) >= PARALLEL_STAT_MIN_FILES:
+        # Each stat is a blocking syscall (a round-trip on network shares); overlap them
+        with ThreadPoolExecutor(max_workers=PARALLEL_STAT_WORKERS) as pool:
+            images = pool.map(stat_image, entries)
+            return [image for image in images if image is not None]
+    return [image for image in map(stat_image, entries) if image is not None]
 
 def create_index(folder_path):
-    """Create FAISS index for folder"""
+    """Create FAISS index for folder, reusing embeddings of unchanged images
+    
+    Returns embeddings as None when the saved index is already up to date.
+    """
     folder_path = Path(folder_path)
     image_paths = []
-    embeddings = []
     image_metadata = []
     
-    # Supported image formats
-    extensions = config.SUPPORTED_EXTENSIONS
+    # Thumbnails are cached by index row so search results map straight to a file
+    index_path = folder_path / config.INDEX_FOLDER_NAME
+    thumbs_path = index_path / 'thumbs'
+    thumbs_path.mkdir(parents=True, exist_ok=True)
+    thumbnail_jobs = []
     
-    for ext in extensions:
-        for img_path in folder_path.glob(f'*{ext}'):
-            try:
-                embedding = get_image_embedding(img_path)
-                embeddings.append(embedding)
-                image_paths.append(str(img_path))
-                
-                # Get file metadata
-                stat = img_path.stat()
-                metadata = {
-                    'path': str(img_path),
-                    'mtime': stat.st_mtime,
-                    'size': stat.st_size
-                }
-                image_metadata.append(metadata)
-            except Exception as e:
-                print(f"Error processing {img_path}: {e}")
+    def add_image(img_path, stat):
+        image_paths.append(img_path)
+        image_metadata.append({
+            'path': img_path,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size
+        })
     
-    if not embeddings:
-        return None, None, None
+    # Near-duplicate bookkeeping: rows already known to be originals, and rows still to check
+    known_rows = []
+    check_rows = []
+    duplicate_of = {}
+    
+    # Previous rows by path
+    previous = load_previous_embeddings(folder_path)
+    if previous:
+        previous_metadata = previous[1]
+    else:
+        # Embeddings from another CLIP model are re-encoded, but thumbnails of unchanged files stay valid
+        previous_metadata = load_metadata(folder_path / config.INDEX_FOLDER_NAME) or []
+    previous_rows = {meta['path']: (row, meta) for row, meta in enumerate(previous_metadata)}
+    unreadable = load_unreadable(folder_path)
+    still_unreadable = {}  # path -> [mtime, size] of files that failed to decode last time and haven't changed
+    reused = []
+    candidates = []
+    stats = []
+    previous_thumbs = {}  # candidate position -> previous row with a still-valid thumbnail
+    for img_path, stat in list_images(folder_path):
+        if unreadable.get(img_path) == [stat.st_mtime, stat.st_size]:
+            still_unreadable[img_path] = unreadable[img_path]
+            continue
+        row, meta = previous_rows.get(img_path, (None, None))
+        unchanged = meta is not None and meta.get('mtime') == stat.st_mtime and meta.get('size') == stat.st_size
+        if unchanged and previous:
+            reused.append((row, img_path, stat))
+        else:
+            if unchanged:
+                previous_thumbs[len(candidates)] = row
+            candidates.append(img_path)
+            stats.append(stat)
+    
+    # Nothing added, changed or removed since an index built with the same settings: keep it
+    previous_settings = load_index_settings(folder_path)
+    if (previous and not candidates and len(reused) == len(previous[1])
+            and previous_settings == index_settings()):
+        for row, img_path, _ in reused:
+            thumb_path = thumbs_path / f'{row}{THUMBNAIL_EXTENSION}'
+            if not thumb_path.exists():
+                thumbnail_jobs.append(thumbnail_executor.submit(save_thumbnail, img_path, thumb_path))
+        for job in thumbnail_jobs:
+            job.result()
+        index, saved_paths, saved_metadata = load_index(folder_path)
+        if index is not None:
+            return index, saved_paths, saved_metadata, None
+    
+    # The new rows' thumbnails are staged and swapped in by save_index once the index using them is saved;
+    # until then (or if indexing fails) the live index keeps its own rows' thumbnails
+    staged_path = index_path / 'thumbs.new'
+    shutil.rmtree(staged_path, ignore_errors=True)  # left by an indexing run that failed
+    staged_path.mkdir()
+    
+    # One FP16 matrix for the whole folder; rows are filled in index order
+    embeddings = np.empty((len(reused) + len(candidates), model.visual.output_dim), dtype=np.float16)
+    
+    if reused:
+        # Keep previous order
+        reused.sort(key=lambda item: item[0])
+        # Gathered straight into the new matrix, without a fancy-indexing temporary of every reused row
+        np.take(previous[0], [row for row, _, _ in reused], axis=0, out=embeddings[:len(reused)])
+        new_rows = {row: new_row for new_row, (row, _, _) in enumerate(reused)}
+        # Links made under another duplicate threshold are all re-checked
+        regroup = (previous_settings or {}).get('duplicate_threshold') != config.DUPLICATE_THRESHOLD
+        for row, img_path, stat in reused:
+            new_row = len(image_paths)
+            thumb_path = staged_path / f'{new_row}{THUMBNAIL_EXTENSION}'
+            if not stage_thumbnail(thumbs_path / f'{row}{THUMBNAIL_EXTENSION}', thumb_path):
+                # e.g. an index written before thumbnails were cached
+                thumbnail_jobs.append(thumbnail_executor.submit(save_thumbnail, img_path, thumb_path))
+            add_image(img_path, stat)
+            
+            # Keep previous duplicate links while the original is still indexed; re-check orphans
+            original = previous[1][row].get('duplicate_of')
+            if regroup:
+                check_rows.append(new_row)
+            elif original is None:
+                known_rows.append(new_row)
+            elif original in new_rows:
+                duplicate_of[new_row] = new_rows[original]
+            else:
+                check_rows.append(new_row)
+    # An approximate index trained on the same model's embeddings can be reused
+    trained = None
+    if reused and len(embeddings) >= config.ANN_THRESHOLD and config.ANN_INDEX_TYPE != 'hnsw':
+        trained = load_trained_index(folder_path)
+    previous = None  # release the memory-mapped embeddings before they are overwritten
+    
+    # Decoding/collation runs on a producer thread, copies on a side stream, encoding here
+    batches = iter_in_background(iter_image_batches(candidates), config.PREFETCH_BATCHES)
+    encoded = set()
+    for positions, images in prefetch_to_device(batches):
+        encoded.update(positions)
+        row = len(image_paths)
+        get_image_embeddings_batch(images, out=embeddings[row:row + len(positions)])
+        for pos in positions:
+            img_path = candidates[pos]
+            check_rows.append(len(image_paths))
+            thumb_path = staged_path / f'{len(image_paths)}{THUMBNAIL_EXTENSION}'
+            previous_row = previous_thumbs.get(pos)
+            if previous_row is None or not stage_thumbnail(thumbs_path / f'{previous_row}{THUMBNAIL_EXTENSION}', thumb_path):
+                thumbnail_jobs.append(thumbnail_executor.submit(save_thumbnail, img_path, thumb_path))
+            add_image(img_path, stats[pos])
+    
+    for job in thumbnail_jobs:
+        job.result()
+    
+    # Remember files that failed to decode so the next re-index skips them until they change
+    for pos in range(len(candidates)):
+        if pos not in encoded:
+            still_unreadable[candidates[pos]] = [stats[pos].st_mtime, stats[pos].st_size]
+    try:
+        data = json.dumps(still_unreadable).encode('utf-8')
+        write_atomic(index_path / 'unreadable.json', lambda f: f.write(data))
+    except OSError as e:
+        logger.warning("Could not save unreadable image list: %s", e)
+    
+    if not image_paths:
+        shutil.rmtree(staged_path, ignore_errors=True)
+        return None, None, None, None
+    
+    # Unreadable images leave unused rows at the end
+    embeddings_array = embeddings[:len(image_paths)]
+    
+    # Near-duplicates stay in the folder listing but only their original goes into FAISS
+    if config.DUPLICATE_THRESHOLD > 0:
+        duplicate_of.update(find_duplicates(embeddings_array, known_rows, check_rows))
+    else:
+        duplicate_of.clear()
+    for row, original in duplicate_of.items():
+        image_metadata[row]['duplicate_of'] = original
+        image_metadata[original].setdefault('duplicates', []).append(row)
     
     # Create FAISS index
-    embeddings_array = np.array(embeddings).astype('float32')
-    index = faiss.IndexFlatIP(embeddings_array.shape[1])  # Inner product for cosine similarity
-    index.add(embeddings_array)
+    if duplicate_of:
+        index = build_index(embeddings_array, [row for row in range(len(image_paths)) if row not in duplicate_of], trained)
+    else:
+        index = build_index(embeddings_array, trained=trained)
     
-    return index, image_paths, image_metadata
+    return index, image_paths, image_metadata, embeddings_array
+
+def load_trained_index(folder_path):
+    """The folder's saved IVFPQ index, whose training can be reused (None for other index types)"""
+    try:
+        saved = faiss.read_index(str(Path(folder_path) / config.INDEX_FOLDER_NAME / 'index.faiss'))
+    except Exception:
+        return None
+    index = unwrap_index(saved)
+    if not isinstance(index, faiss.IndexIVFPQ):
+        return None
+    # An IndexIDMap owns its inner index and frees it along with itself; copy it while the wrapper is alive
+    return faiss.clone_index(index) if index is not saved else index
+
+def index_settings():
+    """Settings that shape a built index; a re-index with different ones rebuilds it"""
+    return {
+        'ann_threshold': config.ANN_THRESHOLD,
+        'ann_index_type': config.ANN_INDEX_TYPE,
+        'flat_index_8bit': config.FLAT_INDEX_8BIT,
+        'flat_index_fp16': config.FLAT_INDEX_FP16,
+        'duplicate_threshold': config.DUPLICATE_THRESHOLD,
+        'thumbnail_format': THUMBNAIL_EXTENSION,
+    }
+
+def load_index_settings(folder_path):
+    """Settings the folder's index was built with (None if unknown)"""
+    try:
+        with open(Path(folder_path) / config.INDEX_FOLDER_NAME / 'settings.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_unreadable(folder_path):
+    """{path: [mtime, size]} of images that failed to decode during the last indexing"""
+    try:
+        with open(Path(folder_path) / config.INDEX_FOLDER_NAME / 'unreadable.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_previous_embeddings(folder_path):
+    """Return (embeddings, metadata) of the existing index if they can be reused, else None"""
+    index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
+    try:
+        if (index_path / 'model.txt').read_text().strip() != config.CLIP_MODEL:
+            return None
+    except OSError:
+        return None
+    
+    embeddings = load_embeddings(folder_path)
+    image_metadata = load_metadata(index_path)
+    if embeddings is None or image_metadata is None or len(embeddings) != len(image_metadata):
+        return None
+    return embeddings, image_metadata
+
+def unit_vectors(rows):
+    """FP32 copy of saved FP16 embedding rows, renormalized in place (FP16 rounding leaves norms slightly off 1)"""
+    vectors = np.ascontiguousarray(rows, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def find_duplicates(embeddings, known_rows, check_rows):
+    """Map each row in check_rows that nearly duplicates an earlier original to that original's row"""
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    originals = list(known_rows)
+    for start in range(0, len(originals), 65536):
+        # FAISS copies added vectors, so a slice at a time keeps only one FP32 copy of the originals alive
+        index.add(unit_vectors(embeddings[originals[start:start + 65536]]))
+    
+    duplicate_of = {}
+    for start in range(0, len(check_rows), 1024):
+        chunk = check_rows[start:start + 1024]
+        vectors = unit_vectors(embeddings[chunk])
+        if index.ntotal:
+            similarities, matches = index.search(vectors, 1)
+        
+        kept = []  # positions in chunk that are originals
+        for i, row in enumerate(chunk):
+            if index.ntotal and similarities[i, 0] >= config.DUPLICATE_THRESHOLD:
+                duplicate_of[row] = originals[matches[i, 0]]
+                continue
+            if kept:
+                # Compare against originals found earlier in this chunk
+                within = vectors[kept] @ vectors[i]
+                best = int(np.argmax(within))
+                if within[best] >= config.DUPLICATE_THRESHOLD:
+                    duplicate_of[row] = chunk[kept[best]]
+                    continue
+            kept.append(i)
+        
+        index.add(vectors[kept])
+        originals.extend(chunk[i] for i in kept)
+    return duplicate_of
+
+def build_index(embeddings, rows=None, trained=None):
+    """Build a FAISS index sized to the collection (exact below ANN_THRESHOLD)
+    
+    With rows given, only those rows are indexed and search returns their row ids.
+    A trained IVFPQ index from the previous build of the folder is reused instead
+    of retraining when its list count still suits the collection.
+    """
+    ids = np.arange(len(embeddings), dtype=np.int64) if rows is None else np.asarray(rows, dtype=np.int64)
+    n, dim = len(ids), embeddings.shape[1]
+    
+    def vectors(selected):
+        # FAISS only accepts FP32 input; converting a slice at a time avoids an FP32 copy of the whole folder
+        return unit_vectors(embeddings[selected])
+    
+    if n < config.ANN_THRESHOLD:
+        if config.FLAT_INDEX_8BIT and not searches_on_gpu(n):
+            # Brute force over 8-bit codes (a quarter of IndexFlatIP); search re-ranks with exact embeddings
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors(ids))  # per-dimension value ranges
+        elif config.FLAT_INDEX_FP16 and not searches_on_gpu(n):
+            # Exact search over vectors stored as FP16 (half the memory and disk of IndexFlatIP)
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # On the GPU the flat index is cloned with FP16 storage instead
+            index = faiss.IndexFlatIP(dim)  # Inner product for cosine similarity
+    elif config.ANN_INDEX_TYPE == 'hnsw' or n < IVFPQ_MIN_TRAINING:
+        # IVFPQ can't train its 256-entry PQ codebooks on a small collection; HNSW needs no training
+        if config.FLAT_INDEX_FP16:
+            # Graph over FP16-stored vectors: ~40% less memory than IndexHNSWFlat at 512 dims, same recall
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+    else:
+        # ~4*sqrt(N) inverted lists, 32 sub-vectors of 8 bits per image
+        nlist = min(4096, int(4 * np.sqrt(n)))
+        if isinstance(trained, faiss.IndexIVFPQ) and trained.d == dim and 0.8 <= trained.nlist / nlist <= 1.25:
+            # Incremental re-index: keep the centroids and codebooks, skip k-means training
+            index = faiss.clone_index(trained)
+            index.reset()
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, 32, 8, faiss.METRIC_INNER_PRODUCT)
+            # k-means would subsample to 256 points per list anyway; sample before converting to FP32
+            sample = ids
+            if n > 256 * nlist:
+                sample = np.sort(np.random.default_rng(0).choice(ids, 256 * nlist, replace=False))
+            index = train_index(index, vectors(sample))
+    
+    if rows is not None:
+        index = faiss.IndexIDMap(index)
+    for start in range(0, n, 65536):
+        chunk = ids[start:start + 65536]
+        if rows is None:
+            index.add(vectors(slice(chunk[0], chunk[-1] + 1)))
+        else:
+            index.add_with_ids(vectors(chunk), chunk)
+    tune_index(index)
+    return index
+
+def train_index(index, training_vectors):
+    """Train an index, running k-means on the GPU when faiss-gpu is available (copied back to the CPU)"""
+    if faiss_res is not None:
+        try:
+            # StandardGpuResources is shared with the search worker and not thread-safe
+            with faiss_gpu_lock:
+                gpu_index = faiss.index_cpu_to_gpu(faiss_res, torch.cuda.current_device(), index)
+                gpu_index.train(training_vectors)
+                return faiss.index_gpu_to_cpu(gpu_index)
+        except Exception as e:
+            logger.warning("Training FAISS index on CPU: %s", e)
+    index.train(training_vectors)
+    return index
+
+def unwrap_index(index):
+    """The index doing the actual search (looks inside IndexIDMap)"""
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+def is_compressed_index(index):
+    """Whether scores come from lossy codes (PQ or 8-bit scalar quantization)"""
+    inner = unwrap_index(index)
+    if 'PQ' in type(inner).__name__:
+        return True
+    return isinstance(inner, faiss.IndexScalarQuantizer) and inner.sq.qtype != faiss.ScalarQuantizer.QT_fp16
+
+def convert_flat_index(index, fp16):
+    """Copy of an exact-search index with its vectors stored as FP16 (fp16=True) or as IndexFlatIP, keeping row ids"""
+    inner = unwrap_index(index)
+    if fp16:
+        converted = faiss.IndexScalarQuantizer(inner.d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    else:
+        converted = faiss.IndexFlatIP(inner.d)
+    ids = None
+    if inner is not index:
+        ids = faiss.vector_to_array(index.id_map)
+        converted = faiss.IndexIDMap(converted)
+    
+    # Copy in slices so the whole index is never held as one extra FP32 array
+    for start in range(0, inner.ntotal, 65536):
+        vectors = inner.reconstruct_n(start, min(65536, inner.ntotal - start))
+        if ids is None:
+            converted.add(vectors)
+        else:
+            converted.add_with_ids(vectors, ids[start:start + len(vectors)])
+    return converted
+
+def is_fp16_flat_index(index):
+    """Whether an index is exact search over FP16-stored vectors"""
+    inner = unwrap_index(index)
+    return isinstance(inner, faiss.IndexScalarQuantizer) and inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16
+
+def tune_index(index):
+    """Apply query-time search parameters to approximate indexes"""
+    inner = unwrap_index(index)
+    if hasattr(inner, 'nprobe'):
+        inner.nprobe = config.NPROBE
+    if hasattr(inner, 'hnsw'):
+        inner.hnsw.efSearch = config.HNSW_EF_SEARCH
+    return index
+
+def set_search_depth(index, k):
+    """Widen an HNSW index's candidate list for k results: with efSearch near k, recall of the tail drops sharply"""
+    inner = unwrap_index(index)
+    if hasattr(inner, 'hnsw'):
+        inner.hnsw.efSearch = max(config.HNSW_EF_SEARCH, 2 * k)
+
+def searches_on_gpu(n):
+    """Whether an index of n vectors is searched on the GPU (small ones are faster on the CPU)"""
+    return faiss_res is not None and n >= config.FAISS_GPU_MIN_SIZE
 
-def save_index(index, image_paths, image_metadata, folder_path):
+def index_to_gpu(index):
+    """Move a CPU index onto the GPU when faiss-gpu is available and the index is large enough"""
+    if not searches_on_gpu(index.ntotal):
+        return index
+    
+    if is_fp16_flat_index(index):
+        # Saved in FP16 to halve the file; the GPU flat index takes FP32 input and stores FP16 itself
+        index = convert_flat_index(index, fp16=False)
+    
+    try:
+        options = faiss.GpuClonerOptions()
+        options.useFloat16 = True  # FP16 storage for flat indexes, FP16 lookup tables for IVFPQ
+        return faiss.index_cpu_to_gpu(faiss_res, torch.cuda.current_device(), index, options)
+    except Exception as e:
+        # e.g. HNSW has no GPU implementation
+        logger.warning("Keeping FAISS index on CPU: %s", e)
+        return index
+
+def is_gpu_index(index):
+    """Whether an index (or the index inside an IndexIDMap) lives on the GPU"""
+    return hasattr(faiss, 'GpuIndex') and isinstance(unwrap_index(index), faiss.GpuIndex)
+
+def index_to_cpu(index):
+    """Return a CPU copy of a GPU index (no-op for CPU indexes)"""
+    if is_gpu_index(index):
+        return faiss.index_gpu_to_cpu(index)
+    return index
+
+def search_index(index, query, k, embeddings=None):
+    """Search with one query embedding; returns (similarities, row ids) arrays of shape (1, k)
+    
+    Scores from PQ or 8-bit codes are approximate, so with the saved embeddings
+    the top RERANK_FACTOR * k candidates are re-scored exactly.
+    """
+    query = np.ascontiguousarray(query, dtype=np.float32).reshape(1, -1)
+    rerank = embeddings is not None and config.RERANK_FACTOR > 1 and is_compressed_index(index)
+    fetch = k * config.RERANK_FACTOR if rerank else k
+    
+    # Concurrent requests are searched together by the search worker
+    future = Future()
+    search_queue.put((index, query, fetch, future))
+    similarities, indices = future.result()
+    if not rerank:
+        return similarities, indices
+    
+    # Sorted rows read the memory-mapped embeddings front to back
+    candidates = np.sort(indices[0][indices[0] >= 0])
+    exact = unit_vectors(embeddings[candidates]) @ query[0]
+    order = np.argsort(-exact)[:k]
+    return exact[order][None, :], candidates[order][None, :]
+
+def search_into(index, queries, k, similarities, indices):
+    """index.search writing into preallocated output arrays (older FAISS bindings lack D/I and allocate)"""
+    try:
+        index.search(queries, k, D=similarities, I=indices)
+    except TypeError:
+        similarities[:], indices[:] = index.search(queries, k)
+
+def reserve_buffer(buf, shape):
+    """Return a C-contiguous view of buf with the given shape, growing buf only when it is too small"""
+    size = int(np.prod(shape))
+    if buf[0].size < size:
+        buf[0] = np.empty(size, dtype=buf[0].dtype)
+    return buf[0][:size].reshape(shape)
+
+def search_batch_worker():
+    """Run queued searches together, one FAISS search per index per batch"""
+    # OpenMP thread counts are per calling thread, so this has to be set here rather than at startup;
+    # leaves cores for concurrent indexing and request handling
+    if config.FAISS_SEARCH_THREADS > 0:
+        faiss.omp_set_num_threads(config.FAISS_SEARCH_THREADS)
+    
+    # Only this thread touches these, so the query matrix and FAISS outputs are reused without a lock
+    query_buf = [np.empty(0, dtype=np.float32)]
+    similarity_buf = [np.empty(0, dtype=np.float32)]
+    index_buf = [np.empty(0, dtype=np.int64)]
+    batch = []
+    while True:
+        batch = get_batch(search_queue, config.SEARCH_BATCH_SIZE, batch_wait(batch, config.SEARCH_BATCH_WAIT_MS))
+        
+        # Requests for different folders hold different index objects
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item[0]), []).append(item)
+        
+        for items in groups.values():
+            index = items[0][0]
+            futures = [future for _, _, _, future in items]
+            try:
+                queries = reserve_buffer(query_buf, (len(items), items[0][1].shape[1]))
+                np.concatenate([query for _, query, _, _ in items], out=queries)
+                fetch = max(fetch for _, _, fetch, _ in items)
+                similarities = reserve_buffer(similarity_buf, (len(items), fetch))
+                indices = reserve_buffer(index_buf, (len(items), fetch))
+                set_search_depth(index, fetch)  # only this thread searches, so the index can be adjusted per batch
+                if is_gpu_index(index):
+                    # StandardGpuResources is not thread-safe; index_to_gpu shares it
+                    with faiss_gpu_lock:
+                        search_into(index, queries, fetch, similarities, indices)
+                else:
+                    search_into(index, queries, fetch, similarities, indices)
+                # Copy out: the buffers are overwritten by the next batch
+                for i, (_, _, k, future) in enumerate(items):
+                    future.set_result((similarities[i:i + 1, :k].copy(), indices[i:i + 1, :k].copy()))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+
+def write_atomic(path, write, sync=True):
+    """Write a file through a temporary sibling and os.replace so readers never see partial data
+    
+    With sync the data is fsynced before the rename, so a crash leaves the old or the new file,
+    never a renamed but empty one (skipped for caches like thumbnails).
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def sync_directory(path):
+    """Flush renames in a directory to disk (POSIX only; Windows has no directory fsync)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def index_cache_key(folder_path):
+    """Key for the in-memory index cache"""
+    return os.path.normcase(os.path.abspath(folder_path))
+
+def cache_index(key, entry):
+    """Keep a loaded index in memory, evicting the least recently used folders (call with index_cache_lock held)"""
+    index_cache[key] = entry
+    index_cache.move_to_end(key)
+    while len(index_cache) > max(config.INDEX_CACHE_SIZE, 1):
+        index_cache.popitem(last=False)
+
+def folder_lock(key):
+    """The lock serializing slow loads and saves of one folder's index (call with index_cache_lock held)"""
+    lock = folder_locks.get(key)
+    if lock is None:
+        lock = folder_locks[key] = threading.RLock()
+    return lock
+
+def save_index(index, image_paths, image_metadata, folder_path, embeddings=None):
     """Save FAISS index and metadata"""
     index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
     index_path.mkdir(exist_ok=True)
     
-    # Save FAISS index
-    faiss.write_index(index, str(index_path / 'index.faiss'))
+    key = index_cache_key(folder_path)
+    with index_cache_lock:
+        lock = folder_lock(key)
+    
+    # Searches of other folders go on while this one is written; loads of this one wait for it
+    with lock:
+        with index_cache_lock:
+            # Drop the cached index first so its memory-mapped paths and embeddings are released before replacing them
+            index_cache.pop(key, None)
+            embeddings_cache.pop(key, None)
+        
+        # Save raw embeddings (FP16) so the index can be rebuilt without re-encoding
+        if embeddings is not None:
+            write_atomic(index_path / 'embeddings.npy', lambda f: np.save(f, np.asarray(embeddings, dtype=np.float16)))
+            write_atomic(index_path / 'model.txt', lambda f: f.write(config.CLIP_MODEL.encode()))
+            write_atomic(index_path / 'settings.json', lambda f: f.write(json.dumps(index_settings()).encode()))
+        
+        # Save image paths as one UTF-8 blob plus row offsets
+        save_paths(index_path, image_paths)
+        
+        # Save image metadata (and cache it in its columnar form, as load_index would)
+        image_metadata = save_metadata(index_path, image_metadata)
+        
+        # Save FAISS index last (always in CPU format); its mtime marks the index version
+        cpu_index = index_to_cpu(index)
+        if config.FLAT_INDEX_FP16 and isinstance(unwrap_index(cpu_index), faiss.IndexFlatIP):
+            # GPU-sized flat indexes are kept FP32 in memory but stored as FP16 (half the file and load time)
+            cpu_index = convert_flat_index(cpu_index, fp16=True)
+        write_atomic(index_path / 'index.faiss', lambda f: faiss.write_index(cpu_index, faiss.PyCallbackIOWriter(f.write)))
+        sync_directory(index_path)
+        
+        # Searches pick up the freshly built index without reading it back
+        mtime = (index_path / 'index.faiss').stat().st_mtime_ns
+        if not isinstance(image_paths, PathRows):
+            image_paths = PathList(image_paths)  # keep index() a hashed lookup, as for loaded indexes
+        index = index_to_gpu(index)
+        with index_cache_lock:
+            cache_index(key, (mtime, index, image_paths, image_metadata))
+        commit_thumbnails(index_path)
+
+def commit_thumbnails(index_path):
+    """Swap the thumbnails staged by create_index in for the live ones (with the folder's lock held, once index.faiss is saved)"""
+    staged_path = index_path / 'thumbs.new'
+    if not staged_path.is_dir():
+        return
+    thumbs_path = index_path / 'thumbs'
+    old_path = index_path / 'thumbs.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    
+    # A rebuild still writing into the live directory would land in the new one once it is swapped in
+    with pending_thumbnails_lock:
+        jobs = [job for thumb_path, job in pending_thumbnails.items() if thumb_path.parent == thumbs_path]
+    for job in jobs:
+        job.result()
+    
+    try:
+        if thumbs_path.exists():
+            os.replace(thumbs_path, old_path)
+        os.replace(staged_path, thumbs_path)
+    except OSError as e:
+        # e.g. Windows refusing to rename a directory with a thumbnail open: move the files over one by one
+        logger.warning("Moving staged thumbnails of %s file by file: %s", index_path, e)
+        thumbs_path.mkdir(exist_ok=True)
+        names = set()
+        for path in staged_path.iterdir():
+            os.replace(path, thumbs_path / path.name)
+            names.add(path.name)
+        for path in thumbs_path.iterdir():
+            if path.name not in names:
+                path.unlink(missing_ok=True)
+        shutil.rmtree(staged_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    
+    # Rebuilds were of the old rows' thumbnails, which are gone now
+    with pending_thumbnails_lock:
+        for thumb_path in [thumb_path for thumb_path in thumbnail_sources if thumb_path.parent == thumbs_path]:
+            del thumbnail_sources[thumb_path]
+
+def save_paths(index_path, image_paths):
+    """Save image paths as one UTF-8 blob plus row offsets, replacing any older paths.pkl"""
+    encoded_paths = [p.encode('utf-8', 'surrogateescape') for p in image_paths]
+    offsets = np.zeros(len(encoded_paths) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in encoded_paths], out=offsets[1:])
+    write_atomic(index_path / 'paths.bin', lambda f: f.write(b''.join(encoded_paths)))
+    write_atomic(index_path / 'offsets.npy', lambda f: np.save(f, offsets))
+    (index_path / 'paths.pkl').unlink(missing_ok=True)
+
+class PathRows:
+    """index() in O(log n) for image path lists, via a sorted table of path hashes built on first use
+    
+    16 bytes per path instead of a dict holding every path as a Python string, which for
+    memory-mapped paths would cost several times the mapping itself.
+    """
+    hashes = None
+    rows = None
+    
+    def build_lookup(self):
+        """Build the sorted hash table behind index() (done on its first call otherwise)"""
+        if self.hashes is None:
+            hashes = np.fromiter(map(hash, self), dtype=np.int64, count=len(self))
+            rows = np.argsort(hashes, kind='stable')
+            self.rows = rows
+            self.hashes = hashes[rows]  # set last: other threads check it before reading rows
     
-    # Save image paths
-    with open(index_path / 'paths.pkl', 'wb') as f:
-        pickle.dump(image_paths, f)
+    def index(self, path):
+        """Row of a path like list.index"""
+        self.build_lookup()
+        key = hash(path)
+        # Equal hashes are rare; compare the paths themselves
+        for i in range(int(np.searchsorted(self.hashes, key)), len(self.hashes)):
+            if self.hashes[i] != key:
+                break
+            row = int(self.rows[i])
+            if self[row] == path:
+                return row
+        raise ValueError(f'{path!r} is not indexed')
+
+class PathList(PathRows, list):
+    """In-memory image paths (indexes whose paths.pkl could not be converted)"""
+
+class MMapPaths(PathRows):
+    """Read-only list of image paths backed by memory-mapped paths.bin/offsets.npy (read in on Windows)"""
+    def __init__(self, index_path):
+        if not MMAP_INDEX_FILES:
+            # A mapping would keep save_paths from replacing the files while a search still holds these paths
+            self.offsets = np.load(index_path / 'offsets.npy')
+            self.data = (index_path / 'paths.bin').read_bytes()
+            return
+        self.offsets = np.load(index_path / 'offsets.npy', mmap_mode='r')
+        with open(index_path / 'paths.bin', 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+    
+    def __len__(self):
+        return len(self.offsets) - 1
     
-    # Save image metadata
-    with open(index_path / 'metadata.pkl', 'wb') as f:
-        pickle.dump(image_metadata, f)
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('path index out of range')
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8', 'surrogateescape')
+    
+    def __iter__(self):
+        # Plain int offsets: indexing the memory-mapped array per row would box a NumPy scalar each time
+        bounds = self.offsets.tolist()
+        data = self.data
+        return (data[start:end].decode('utf-8', 'surrogateescape') for start, end in zip(bounds, bounds[1:]))
 
 def load_index(folder_path):
-    """Load FAISS index and metadata"""
+    """Load FAISS index and metadata (cached in memory until index.faiss changes)"""
     index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
     
-    if not index_path.exists():
+    try:
+        mtime = (index_path / 'index.faiss').stat().st_mtime_ns
+    except OSError:
         return None, None, None
     
-    try:
-        # Load FAISS index
-        index = faiss.read_index(str(index_path / 'index.faiss'))
-        
-        # Load image paths
-        with open(index_path / 'paths.pkl', 'rb') as f:
-            image_paths = pickle.load(f)
+    key = index_cache_key(folder_path)
+    with index_cache_lock:
+        cached = index_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            index_cache.move_to_end(key)
+            return cached[1:]
+        lock = folder_lock(key)
+    
+    # Read outside index_cache_lock so searches of other folders aren't held up by this one loading
+    with lock:
+        try:
+            mtime = (index_path / 'index.faiss').stat().st_mtime_ns
+        except OSError:
+            return None, None, None
+        with index_cache_lock:
+            # Loaded (or saved) by another thread while this one waited
+            cached = index_cache.get(key)
+            if cached is not None and cached[0] == mtime:
+                index_cache.move_to_end(key)
+                return cached[1:]
         
-        # Load image metadata (backwards compatible)
-        image_metadata = None
-        metadata_file = index_path / 'metadata.pkl'
-        if metadata_file.exists():
-            try:
-                with open(metadata_file, 'rb') as f:
-                    image_metadata = pickle.load(f)
-            except:
-                image_metadata = None
+        try:
+            # Load FAISS index; flat and scalar-quantized codes are memory-mapped rather than read in
+            index = index_to_gpu(tune_index(faiss.read_index(str(index_path / 'index.faiss'), INDEX_READ_FLAGS)))
+            
+            # Load image paths (indexes created before paths.bin use paths.pkl)
+            if (index_path / 'paths.bin').exists():
+                image_paths = MMapPaths(index_path)
+            else:
+                with open(index_path / 'paths.pkl', 'rb') as f:
+                    image_paths = PathList(pickle.load(f))
+                try:
+                    # Convert once so later loads memory-map instead of unpickling
+                    save_paths(index_path, image_paths)
+                    image_paths = MMapPaths(index_path)
+                except OSError as e:
+                    logger.warning("Could not convert paths.pkl in %s: %s", index_path, e)
+            
+            image_metadata = load_metadata(index_path)
+        except:
+            return None, None, None
         
+        with index_cache_lock:
+            cache_index(key, (mtime, index, image_paths, image_metadata))
         return index, image_paths, image_metadata
-    except:
-        return None, None, None
+
+def save_metadata(index_path, image_metadata):
+    """Save image metadata as Parquet columns when pyarrow is installed, else pickle
+    
+    Returns the metadata in the form load_metadata gives it back (MetadataColumns with pyarrow).
+    """
+    if pq is None:
+        write_atomic(index_path / 'metadata.pkl', lambda f: pickle.dump(image_metadata, f, protocol=pickle.HIGHEST_PROTOCOL))
+        (index_path / 'metadata.parquet').unlink(missing_ok=True)
+        return image_metadata
+    
+    # One column per key; rows without a key (e.g. 'duplicates') hold nulls
+    keys = list(dict.fromkeys(key for meta in image_metadata for key in meta))
+    table = pa.table({key: [meta.get(key) for meta in image_metadata] for key in keys})
+    write_atomic(index_path / 'metadata.parquet', lambda f: pq.write_table(table, f))
+    (index_path / 'metadata.pkl').unlink(missing_ok=True)
+    return MetadataColumns(table)
+
+class MetadataColumns:
+    """Read-only list of per-image metadata dicts backed by the columns of metadata.parquet
+    
+    Rows are built on access, so loading a large folder doesn't create a dict per image;
+    numeric columns without nulls (mtime, size) are kept as NumPy arrays.
+    """
+    def __init__(self, table):
+        self.length = table.num_rows
+        self.columns = {}
+        for name in table.column_names:
+            column = table.column(name)
+            if column.null_count == 0 and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+                self.columns[name] = column.to_numpy()
+            else:
+                self.columns[name] = column.to_pylist()
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, i):
+        i = int(i)
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('metadata index out of range')
+        row = {}
+        for name, values in self.columns.items():
+            value = values[i]
+            if isinstance(values, np.ndarray):
+                row[name] = value.item()  # plain int/float, e.g. for jsonify
+            elif value is not None:
+                row[name] = value
+        return row
+    
+    def __iter__(self):
+        return (self[i] for i in range(self.length))
+
+def metadata_values(image_metadata, rows, key):
+    """One numeric metadata field for several rows as a float64 array (0 where missing)"""
+    column = getattr(image_metadata, 'columns', {}).get(key)
+    if isinstance(column, np.ndarray):
+        # Gather straight from the column, no per-row dicts
+        values = np.zeros(len(rows))
+        valid = rows < len(column)
+        values[valid] = column[rows[valid]]
+        return values
+    return np.array([image_metadata[row].get(key, 0) if row < len(image_metadata) else 0 for row in rows],
+                    dtype=np.float64)
+
+def load_metadata(index_path):
+    """Load image metadata (backwards compatible: None if missing or unreadable)"""
+    try:
+        if pq is not None and (index_path / 'metadata.parquet').exists():
+            return MetadataColumns(pq.read_table(index_path / 'metadata.parquet', memory_map=MMAP_INDEX_FILES))
+        
+        with open(index_path / 'metadata.pkl', 'rb') as f:
+            image_metadata = pickle.load(f)
+    except FileNotFoundError:
+        return None  # not indexed yet
+    except Exception as e:
+        # e.g. a truncated file: an Arrow or unpickling error
+        logger.warning("Could not load metadata in %s: %s", index_path, e)
+        return None
+    
+    if pq is not None:
+        try:
+            # Convert once so later loads read Parquet instead of unpickling
+            save_metadata(index_path, image_metadata)
+        except OSError as e:
+            logger.warning("Could not convert metadata.pkl in %s: %s", index_path, e)
+    return image_metadata
+
+def indexed_row(image_paths, image_path):
+    """Row of an image path, also when it is spelled differently from the indexed one (separators, relative, case on Windows)"""
+    try:
+        return image_paths.index(image_path)
+    except ValueError:
+        if not len(image_paths):
+            raise
+    # Indexed images sit directly in one folder, so a path to that folder maps onto the indexed spelling
+    indexed_folder = os.path.dirname(image_paths[0])
+    if index_cache_key(os.path.dirname(image_path)) != index_cache_key(indexed_folder):
+        raise ValueError(f'{image_path!r} is not indexed')
+    name = os.path.basename(image_path)
+    try:
+        return image_paths.index(os.path.join(indexed_folder, name))
+    except ValueError:
+        if os.path.normcase('A') == 'A':
+            raise  # case-sensitive file names
+    # The name differs only in case: compare normalized names (a scan, for this rare spelling only)
+    name = os.path.normcase(name)
+    for row, path in enumerate(image_paths):
+        if os.path.normcase(os.path.basename(path)) == name:
+            return row
+    raise ValueError(f'{image_path!r} is not indexed')
+
+def get_indexed_embedding(folder_path, image_paths, image_metadata, image_path):
+    """Saved embedding of an already indexed, unchanged image (None if it must be encoded)"""
+    try:
+        row = indexed_row(image_paths, image_path)
+        meta = image_metadata[row]
+        stat = os.stat(image_path)
+    except (ValueError, IndexError, TypeError, OSError):
+        return None
+    if meta.get('mtime') != stat.st_mtime or meta.get('size') != stat.st_size:
+        return None
+    
+    embeddings = load_embeddings(folder_path)
+    if embeddings is None or row >= len(embeddings):
+        return None
+    return unit_vectors(embeddings[row:row + 1])[0]
+
+def load_embeddings(folder_path):
+    """Memory-map the saved FP16 embeddings (read in on Windows), or None if the index predates them
+    
+    The mapping is kept with the loaded indexes, so searches re-ranking against it
+    pay one stat instead of opening the file and parsing its header every time.
+    """
+    embeddings_file = Path(folder_path) / config.INDEX_FOLDER_NAME / 'embeddings.npy'
+    try:
+        mtime = embeddings_file.stat().st_mtime_ns
+    except OSError:
+        return None
+    
+    key = index_cache_key(folder_path)
+    with index_cache_lock:
+        cached = embeddings_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            embeddings_cache.move_to_end(key)
+            return cached[1]
+    
+    try:
+        # Not mapped on Windows, where the mapping would keep a re-index from replacing embeddings.npy
+        embeddings = np.load(embeddings_file, mmap_mode='r' if MMAP_INDEX_FILES else None)
+    except (OSError, ValueError):
+        return None
+    with index_cache_lock:
+        embeddings_cache[key] = (mtime, embeddings)
+        embeddings_cache.move_to_end(key)
+        while len(embeddings_cache) > max(config.INDEX_CACHE_SIZE, 1):
+            embeddings_cache.popitem(last=False)
+    return embeddings
+
+def encode_thumbnail(img_path):
+    """Create JPEG (or WebP) thumbnail bytes (or a bytes-like view of them) for an image"""
+    img = open_image(img_path, config.THUMBNAIL_SIZE, fit=True)
+    # draft() already decoded near the target size, so BICUBIC looks the same as LANCZOS at a fraction of the cost
+    img.thumbnail(config.THUMBNAIL_SIZE, Image.Resampling.BICUBIC)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    if THUMBNAIL_EXTENSION != '.webp' and turbo_jpeg is not None:
+        return turbo_jpeg.encode(np.asarray(img), quality=config.THUMBNAIL_QUALITY, pixel_format=TJPF_RGB)
+    
+    buffer = BytesIO()
+    if THUMBNAIL_EXTENSION == '.webp':
+        img.save(buffer, format='WEBP', quality=config.THUMBNAIL_QUALITY, method=4)
+    else:
+        img.save(buffer, format='JPEG', quality=config.THUMBNAIL_QUALITY, optimize=False, progressive=False)
+    # A view of the encoded bytes for the file write, instead of getvalue()'s copy of them
+    return buffer.getbuffer()
+
+def stage_thumbnail(thumb_path, staged_path):
+    """Link (or copy) a still-valid thumbnail into the staging directory under its new row; False if it is missing"""
+    try:
+        os.link(thumb_path, staged_path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # e.g. a file system without hard links
+        try:
+            shutil.copyfile(thumb_path, staged_path)
+        except OSError:
+            return False
+    return True
+
+def save_thumbnail(img_path, thumb_path):
+    """Write an image's thumbnail to the index thumbnail cache"""
+    try:
+        data = encode_thumbnail(img_path)
+        write_atomic(thumb_path, lambda f: f.write(data), sync=False)
+    except Exception as e:
+        logger.warning("Error creating thumbnail for %s: %s", img_path, e)
+
+def image_source(img_path):
+    """(path, mtime, size) of an image as it is now, or None if it is gone"""
+    try:
+        stat = os.stat(img_path)
+    except OSError:
+        return None
+    return (img_path, stat.st_mtime, stat.st_size)
+
+def thumbnail_is_current(source, thumb_path, meta=None):
+    """Whether a row's thumbnail was built from the image source as it is now, keyed by (path, mtime, size)
+    
+    Thumbnails written at index time match the row's metadata, so an unchanged image costs one stat
+    and no thumbnail lookup (/thumb still builds one that has gone missing). A thumbnail rebuilt since
+    is recorded with the source it came from; anything else is stale.
+    """
+    if source is None:
+        return True  # image gone; the old thumbnail is the best there is
+    if meta is not None and source[1:] == (meta.get('mtime'), meta.get('size')):
+        return True
+    return thumbnail_sources.get(thumb_path) == source
+
+def ensure_thumbnail(img_path, thumb_path, meta=None, source=None):
+    """Build a missing or stale thumbnail on the thumbnail pool, joining a job already running for it (None if cached)"""
+    if thumbnail_is_current(source or image_source(img_path), thumb_path, meta):
+        return None
+    with pending_thumbnails_lock:
+        job = pending_thumbnails.get(thumb_path)
+        if job is not None:
+            return job
+        job = result_thumbnail_executor.submit(rebuild_thumbnail, img_path, thumb_path)
+        pending_thumbnails[thumb_path] = job
+    
+    # Registered outside the lock: the callback runs immediately if the job already finished
+    job.add_done_callback(lambda _: finish_thumbnail_job(thumb_path))
+    return job
+
+def rebuild_thumbnail(img_path, thumb_path):
+    """Write a thumbnail outside indexing and remember which (path, mtime, size) it was built from"""
+    try:
+        stat = os.stat(img_path)
+    except OSError:
+        return
+    save_thumbnail(img_path, thumb_path)
+    with pending_thumbnails_lock:
+        thumbnail_sources[thumb_path] = (img_path, stat.st_mtime, stat.st_size)
+        thumbnail_sources.move_to_end(thumb_path)
+        while len(thumbnail_sources) > THUMBNAIL_SOURCES_SIZE:
+            thumbnail_sources.popitem(last=False)
+
+def prewarm_thumbnail(img_path, thumb_path, meta):
+    """Start a result's missing or stale thumbnail; returns its URL's version suffix
+    
+    An image edited since indexing gets a thumbnail of its own under the same row, so its URL
+    carries the new (mtime, size): browsers holding the indexed one as immutable fetch it again.
+    """
+    source = image_source(img_path)
+    ensure_thumbnail(img_path, thumb_path, meta, source)
+    if source is None or meta is None or source[1:] == (meta.get('mtime'), meta.get('size')):
+        return ''
+    return f'&e={source[1]!r}-{source[2]}'
+
+def finish_thumbnail_job(thumb_path):
+    """Forget a completed thumbnail job"""
+    with pending_thumbnails_lock:
+        pending_thumbnails.pop(thumb_path, None)
+
+def thumbnail_url_format(folder_path):
+    """URL template for a folder's thumbnails, versioned by the index so re-indexing busts browser caches"""
+    token = hashlib.sha1(index_cache_key(folder_path).encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    thumb_folders[token] = folder_path
+    
+    try:
+        version = (Path(folder_path) / config.INDEX_FOLDER_NAME / 'index.faiss').stat().st_mtime_ns
+    except OSError:
+        version = 0
+    return f'/thumb/{token}/{{}}{THUMBNAIL_EXTENSION}?v={version}'
 
 def load_comments(folder_path):
-    """Load comments from JSON file"""
+    """Comments of a folder as {image path: [comments]} (a shallow copy of the in-memory cache)"""
+    with comments_lock:
+        return dict(cached_comments(folder_path)[0])
+
+def comments_signature(index_path):
+    """comments.json mtime and comments.jsonl size; a change not made through this cache means another writer"""
+    signature = []
+    for name, field in (('comments.json', 'st_mtime_ns'), ('comments.jsonl', 'st_size')):
+        try:
+            signature.append(getattr((index_path / name).stat(), field))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def cached_comments(folder_path):
+    """Cache entry for a folder's comments, reading comments.json plus comments.jsonl on a miss (call with comments_lock held)"""
+    key = index_cache_key(folder_path)
     index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
-    comments_file = index_path / 'comments.json'
+    entry = comments_cache.get(key)
+    if entry is not None and entry[2] == comments_signature(index_path):
+        comments_cache.move_to_end(key)
+        return entry
     
-    if not comments_file.exists():
-        return {}
+    comments_data = {}
+    json_loads = orjson.loads if orjson is not None else json.loads
+    try:
+        with open(index_path / 'comments.json', 'rb') as f:
+            comments_data = json_loads(f.read())
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception("Error loading comments")
     
+    # Replay comments appended since the last compaction
+    log_lines = 0
+    torn = False
     try:
-        import json
-        with open(comments_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+        # Bytes lines: orjson parses them without decoding to str first
+        with open(index_path / 'comments.jsonl', 'rb') as f:
+            for line in f:
+                try:
+                    record = json_loads(line)
+                except ValueError:
+                    torn = True  # last line of an interrupted write
+                    continue
+                comments_data.setdefault(record['path'], []).append(record['comment'])
+                log_lines += 1
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.exception("Error replaying comment log")
+    if torn and save_comments(folder_path, comments_data):
+        log_lines = 0  # compacted so new lines are not appended to the broken one
+    
+    entry = [comments_data, log_lines, comments_signature(index_path)]
+    comments_cache[key] = entry
+    while len(comments_cache) > max(config.INDEX_CACHE_SIZE, 1):
+        comments_cache.popitem(last=False)
+    return entry
 
 def save_comments(folder_path, comments_data):
-    """Save comments to JSON file"""
+    """Save comments to JSON file and clear the append log it supersedes"""
     index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
     index_path.mkdir(exist_ok=True)
-    comments_file = index_path / 'comments.json'
     
     try:
-        import json
-        with open(comments_file, 'w', encoding='utf-8') as f:
-            json.dump(comments_data, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            data = orjson.dumps(comments_data, option=orjson.OPT_INDENT_2)
+        else:
+            data = json.dumps(comments_data, ensure_ascii=False, indent=2).encode('utf-8')
+        write_atomic(index_path / 'comments.json', lambda f: f.write(data))
+        sync_directory(index_path)  # the new comments.json must be durable before the log goes
+        (index_path / 'comments.jsonl').unlink(missing_ok=True)
         return True
-    except Exception as e:
-        print(f"Error saving comments: {e}")
+    except Exception:
+        logger.exception("Error saving comments")
         return False
 
 def get_image_comments(folder_path, image_path):
     """Get comments for specific image"""
-    comments_data = load_comments(folder_path)
-    return comments_data.get(image_path, [])
+    with comments_lock:
+        return list(cached_comments(folder_path)[0].get(image_path, []))
+
+def get_images_comments(folder_path, image_paths):
+    """Get comments for several images at once ({path: comments})"""
+    with comments_lock:
+        comments_data = cached_comments(folder_path)[0]
+        return {path: list(comments_data.get(path, [])) for path in image_paths}
 
 def add_image_comment(folder_path, image_path, comment):
-    """Add new comment to image"""
-    comments_data = load_comments(folder_path)
-    
-    if image_path not in comments_data:
-        comments_data[image_path] = []
-    
+    """Add new comment to image by appending one line to comments.jsonl"""
     # Add timestamp to comment
-    from datetime import datetime
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     comment_with_timestamp = f"[{timestamp}] {comment}"
+    record = {'path': image_path, 'comment': comment_with_timestamp}
+    if orjson is not None:
+        line = orjson.dumps(record) + b'\n'
+    else:
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
     
-    comments_data[image_path].append(comment_with_timestamp)
-    
-    return save_comments(folder_path, comments_data)
+    index_path = Path(folder_path) / config.INDEX_FOLDER_NAME
+    with comments_lock:
+        entry = cached_comments(folder_path)
+        try:
+            index_path.mkdir(exist_ok=True)
+            with open(index_path / 'comments.jsonl', 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception:
+            logger.exception("Error saving comment")
+            return False
+        
+        entry[0].setdefault(image_path, []).append(comment_with_timestamp)
+        entry[1] += 1
+        # Threshold grows with the file so the full rewrite stays amortized O(1) per comment
+        if entry[1] >= max(COMMENT_LOG_COMPACT_LINES, len(entry[0])) and save_comments(folder_path, entry[0]):
+            entry[1] = 0
+        entry[2] = comments_signature(index_path)  # our own write, not a reason to reload
+    return True
 
-@app.route('/')
-def home():
-    """Serve the frontend"""
-    # Generate result limit options dynamically based on config
-    result_options = []
-    
-    # Create a reasonable set of options between min and max
-    min_val = config.MIN_RESULTS
-    max_val = config.MAX_RESULTS
-    default_val = config.DEFAULT_RESULTS
-    
-    # Generate options with reasonable intervals
-    options = set()
-    
-    # Always include min, default, and max
-    options.add(min_val)
-    options.add(default_val)
-    options.add(max_val)
-    
-    # Add some intermediate values
+def result_limit_options(min_val, default_val, max_val):
+    """Sorted result limits offered in the dropdown: min, default, max and a few steps between"""
     if max_val <= 20:
-        # Small range: add every 2-3 values
-        for i in range(min_val, max_val + 1):
-            if i % 2 == 0 or i % 3 == 0:
-                options.add(i)
+        # Small range: every multiple of 2 or 3
+        steps = (i for i in range(min_val, max_val + 1) if i % 2 == 0 or i % 3 == 0)
     else:
-        # Larger range: add multiples of 6, 12, etc.
-        for i in [6, 12, 18, 24, 30]:
-            if min_val <= i <= max_val:
-                options.add(i)
-    
-    # Sort and create HTML options
-    for i in sorted(options):
-        selected = "selected" if i == default_val else ""
-        result_options.append(f'<option value="{i}" {selected}>{i}</option>')
-    
+        # Larger range: multiples of 6
+        steps = (i for i in (6, 12, 18, 24, 30) if min_val <= i <= max_val)
+    return sorted({min_val, default_val, max_val, *steps})
+
+def render_home():
+    """Build the frontend page from config (home_page keeps the result; config only changes on restart)"""
+    # Result limit dropdown, built from config
+    result_options = [f'<option value="{i}" {"selected" if i == config.DEFAULT_RESULTS else ""}>{i}</option>'
+                      for i in result_limit_options(config.MIN_RESULTS, config.DEFAULT_RESULTS, config.MAX_RESULTS)]
     result_options_html = '\n                            '.join(result_options)
     
     # Use string formatting for the result options
@@ -231,7 +1899,6 @@ def home():
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Natural Language Image Search</title>
-    <!-- Cache buster: {timestamp} -->
     <style>
         * {
             margin: 0;
@@ -715,6 +2382,16 @@ def home():
             cursor: pointer;
             transition: all 0.3s;
             border: 1px solid #262626;
+            /* Skip style/layout/paint of cards scrolled out of view (long result lists) */
+            content-visibility: auto;
+            contain-intrinsic-size: auto 220px;
+        }
+        
+        /* Marks the end of the rendered results; more are rendered as it nears the viewport */
+        .results-sentinel {
+            grid-column: 1 / -1;
+            height: 1px;
+            margin-top: -1.5rem; /* cancel the grid gap above it */
         }
         
         .result-item:hover {
@@ -724,6 +2401,7 @@ def home():
         
         .result-item.expanded {
             grid-column: 1 / -1;
+            content-visibility: visible;
         }
         
         .thumbnail {
@@ -750,6 +2428,11 @@ def home():
             font-size: 0.8rem;
         }
         
+        .similarity .duplicates {
+            color: #aaa;
+            cursor: help;
+        }
+        
         .loading {
             text-align: center;
             padding: 2rem;
@@ -932,7 +2615,7 @@ def home():
             cursor: pointer;
             pointer-events: auto; /* Re-enable clicks for the icon */
             transition: all 0.2s ease;
-            display: flex;
+            display: none;
             align-items: center;
             justify-content: center;
         }
@@ -944,7 +2627,17 @@ def home():
         
         /* Show find similar icon only when expanded */
         .result-item.expanded .find-similar-icon {
-            display: flex !important;
+            display: flex;
+        }
+        
+        /* Both expand and collapse icons are in the markup; the expanded class picks one */
+        .result-item .icon-collapse,
+        .result-item.expanded .icon-expand {
+            display: none;
+        }
+        
+        .result-item.expanded .icon-collapse {
+            display: inline;
         }
         
         /* Copy icon styling */
@@ -959,6 +2652,10 @@ def home():
             fill: #e0e0e0;
         }
         
+        .copy-icon.copied {
+            fill: #4caf50;
+        }
+        
         .filename {
             display: flex;
             align-items: center;
@@ -975,6 +2672,50 @@ def home():
     </style>
 </head>
 <body>
+    <!-- Icons drawn once and referenced with <use> by every result -->
+    <svg xmlns="http://www.w3.org/2000/svg" style="display: none;">
+        <symbol id="ico-expand" viewBox="0 -960 960 960"><path d="M240-240v-240h72v168h168v72H240Zm408-240v-168H480v-72h240v240h-72Z"/></symbol>
+        <symbol id="ico-collapse" viewBox="0 -960 960 960"><path d="M432-432v240h-72v-168H192v-72h240Zm168-336v168h168v72H528v-240h72Z"/></symbol>
+        <symbol id="ico-find-similar" viewBox="0 -960 960 960"><path d="M784-120 532-372q-30 24-69 38t-83 14q-109 0-184.5-75.5T120-580q0-109 75.5-184.5T380-840q109 0 184.5 75.5T640-580q0 44-14 83t-38 69l252 252-56 56ZM380-400q75 0 127.5-52.5T560-580q0-75-52.5-127.5T380-760q-75 0-127.5 52.5T200-580q0 75 52.5 127.5T380-400Z"/></symbol>
+        <symbol id="ico-copy" viewBox="0 -960 960 960"><path d="M360-240q-29.7 0-50.85-21.15Q288-282.3 288-312v-480q0-29.7 21.15-50.85Q330.3-864 360-864h384q29.7 0 50.85 21.15Q816-821.7 816-792v480q0 29.7-21.15 50.85Q773.7-240 744-240H360Zm0-72h384v-480H360v480ZM216-96q-29.7 0-50.85-21.15Q144-138.3 144-168v-552h72v552h456v72H216Zm144-216v-480 480Z"/></symbol>
+    </svg>
+    <!-- Result item skeleton, cloned per result so rendering never re-parses HTML -->
+    <template id="result-template">
+        <div class="result-item">
+            <div class="image-container">
+                <img class="thumbnail" alt="" loading="lazy" decoding="async" />
+                <div class="image-overlay">
+                    <div class="expand-collapse-icon" data-action="expand">
+                        <svg class="icon-expand" height="20px" width="20px" fill="#e3e3e3"><use href="#ico-expand"/></svg>
+                        <svg class="icon-collapse" height="20px" width="20px" fill="#e3e3e3"><use href="#ico-collapse"/></svg>
+                    </div>
+                    <div class="find-similar-icon" data-action="find-similar">
+                        <svg height="20px" width="20px" fill="#e3e3e3"><use href="#ico-find-similar"/></svg>
+                    </div>
+                </div>
+            </div>
+            <div class="result-info">
+                <div class="filename"><svg class="copy-icon" data-action="copy" height="16px" width="16px" fill="#888"><use href="#ico-copy"/></svg></div>
+                <div class="similarity"></div>
+            </div>
+        </div>
+    </template>
+    <!-- One comment, cloned per comment when a list is rendered -->
+    <template id="comment-template">
+        <div class="comment-item"><div class="comment-timestamp"></div><div class="comment-text"></div></div>
+    </template>
+    <!-- Comment section, cloned into an item the first time it is expanded -->
+    <template id="comment-section-template">
+        <div class="comment-section">
+            <div class="comments-list">
+                <div class="comment-loading">Loading comments...</div>
+            </div>
+            <div class="comment-form">
+                <textarea class="comment-input" placeholder="Add a comment... (Enter to save, Shift+Enter for a new line)"></textarea>
+                <button class="save-comment-btn" data-action="save-comment">Save</button>
+            </div>
+        </div>
+    </template>
     <div class="container">
         <div class="header">
             <h1>Natural Language Image Search</h1>
@@ -1091,6 +2832,14 @@ def home():
                         <option value="ViT-L/14">ViT-L/14</option>
                     </select>
                 </div>
+                <div class="settings-row">
+                    <label class="settings-label">CLIP Device:</label>
+                    <select id="clipDevice" class="settings-select">
+                        <option value="auto">Auto (GPU if available)</option>
+                        <option value="cuda">GPU (CUDA)</option>
+                        <option value="cpu">CPU</option>
+                    </select>
+                </div>
                 <div class="settings-row">
                     <label class="settings-label">Batch Size:</label>
                     <input type="number" id="batchSize" class="settings-input" min="1" max="128" placeholder="32">
@@ -1161,6 +2910,7 @@ def home():
         // Settings modal functionality
         settingsBtn.addEventListener('click', () => {
             settingsModal.style.display = 'block';
+            settingsEdited = false;
             loadSettings();
         });
         
@@ -1175,74 +2925,139 @@ def home():
             }
         });
         
-        // Thumbnail quality slider update
-        thumbnailQualitySlider.addEventListener('input', (e) => {
-            qualityValue.textContent = e.target.value;
+        // Thumbnail quality slider update, at most once per frame while dragging
+        let qualityFrame = 0;
+        thumbnailQualitySlider.addEventListener('input', () => {
+            if (qualityFrame) return;
+            qualityFrame = requestAnimationFrame(() => {
+                qualityFrame = 0;
+                qualityValue.textContent = thumbnailQualitySlider.value;
+            });
         });
         
-        // Load current settings
+        // Settings panel fields: element id (= /settings key), how the value is read, and its default
+        const SETTINGS_FIELDS = [
+            { key: 'host', kind: 'trim', default: '0.0.0.0' },
+            { key: 'port', kind: 'int', default: 5000 },
+            { key: 'debug', kind: 'checked', default: false },
+            { key: 'clipModel', kind: 'value', default: 'ViT-B/32' },
+            { key: 'clipDevice', kind: 'value', default: 'auto' },
+            { key: 'minResults', kind: 'int', default: 3 },
+            { key: 'maxResults', kind: 'int', default: 48 },
+            { key: 'defaultResults', kind: 'int', default: 12 },
+            { key: 'batchSize', kind: 'int', default: 32 },
+            { key: 'thumbnailQuality', kind: 'int', default: 85 },
+            { key: 'maxCommentLength', kind: 'int', default: 100 },
+            { key: 'maxFileSize', kind: 'int', default: 50 },
+            { key: 'indexFolderName', kind: 'trim', default: '.clip_index' }
+        ];
+        const SETTINGS_NODES = Object.fromEntries(SETTINGS_FIELDS.map(field => [field.key, document.getElementById(field.key)]));
+        
+        // Settings from the last load or save, shown at once while /settings is re-fetched
+        const SETTINGS_CACHE_KEY = 'evossearch_settings';
+        const SETTINGS_CACHE_TTL = 5 * 60 * 1000;
+        let settingsEdited = false;  // don't overwrite what the user is typing with the re-fetched values
+        settingsModal.addEventListener('input', () => { settingsEdited = true; });
+        
+        function getCachedSettings() {
+            try {
+                const cached = JSON.parse(localStorage.getItem(SETTINGS_CACHE_KEY));
+                if (cached && Date.now() - cached.timestamp < SETTINGS_CACHE_TTL) return cached.data;
+            } catch (error) {
+                // Storage disabled or entry corrupt: fall through to the network
+            }
+            return null;
+        }
+        
+        function cacheSettings(settings) {
+            try {
+                localStorage.setItem(SETTINGS_CACHE_KEY, JSON.stringify({ data: settings, timestamp: Date.now() }));
+            } catch (error) {
+                // Storage full or disabled; the next open just waits for the fetch
+            }
+        }
+        
+        function fillSettings(settings) {
+            for (const field of SETTINGS_FIELDS) {
+                // Settings cached before a field existed fall back to its default
+                SETTINGS_NODES[field.key][field.kind === 'checked' ? 'checked' : 'value'] = settings[field.key] ?? field.default;
+            }
+            qualityValue.textContent = settings.thumbnailQuality;
+            checkSettingsForm();
+        }
+        
+        function readSettings() {
+            const settings = {};
+            for (const field of SETTINGS_FIELDS) {
+                const node = SETTINGS_NODES[field.key];
+                if (field.kind === 'checked') settings[field.key] = node.checked;
+                else if (field.kind === 'int') settings[field.key] = parseInt(node.value);
+                else if (field.kind === 'trim') settings[field.key] = node.value.trim();
+                else settings[field.key] = node.value;
+            }
+            return settings;
+        }
+        
+        // Load current settings (cached copy first, then revalidated)
         async function loadSettings() {
+            const cached = getCachedSettings();
+            if (cached) fillSettings(cached);
             try {
                 const response = await fetch('/settings');
                 const data = await response.json();
                 
                 if (data.success) {
-                    const settings = data.settings;
-                    document.getElementById('host').value = settings.host;
-                    document.getElementById('port').value = settings.port;
-                    document.getElementById('debug').checked = settings.debug;
-                    document.getElementById('clipModel').value = settings.clipModel;
-                    document.getElementById('minResults').value = settings.minResults;
-                    document.getElementById('maxResults').value = settings.maxResults;
-                    document.getElementById('defaultResults').value = settings.defaultResults;
-                    document.getElementById('batchSize').value = settings.batchSize;
-                    document.getElementById('thumbnailQuality').value = settings.thumbnailQuality;
-                    document.getElementById('qualityValue').textContent = settings.thumbnailQuality;
-                    document.getElementById('maxCommentLength').value = settings.maxCommentLength;
-                    document.getElementById('maxFileSize').value = settings.maxFileSize;
-                    document.getElementById('indexFolderName').value = settings.indexFolderName;
+                    cacheSettings(data.settings);
+                    if (!settingsEdited) fillSettings(data.settings);
                 } else {
                     showSettingsStatus('Error loading settings: ' + data.error, 'error');
                 }
             } catch (error) {
-                showSettingsStatus('Error loading settings: ' + error.message, 'error');
+                if (!cached) showSettingsStatus('Error loading settings: ' + error.message, 'error');
+            }
+        }
+        
+        // Client-side checks shared by the live form check and the save handler; returns an error message or ''
+        function validateSettings(settings) {
+            if (!settings.host) return 'Host cannot be empty';
+            if (SETTINGS_FIELDS.some(field => field.kind === 'int' && Number.isNaN(settings[field.key]))) {
+                return 'Every numeric setting needs a value';
+            }
+            if (settings.minResults >= settings.maxResults) return 'Min results must be less than max results';
+            if (settings.defaultResults < settings.minResults || settings.defaultResults > settings.maxResults) {
+                return 'Default results must be between min and max results';
             }
+            return '';
+        }
+        
+        // While typing, re-check the form after 300ms of quiet and only enable Save for valid settings (no request)
+        let settingsSaving = false;
+        let settingsCheckTimer = null;
+        
+        function checkSettingsForm() {
+            clearTimeout(settingsCheckTimer);
+            const error = validateSettings(readSettings());
+            saveSettingsBtn.disabled = settingsSaving || !!error;
+            saveSettingsBtn.title = error;
         }
         
+        settingsModal.addEventListener('input', () => {
+            clearTimeout(settingsCheckTimer);
+            settingsCheckTimer = setTimeout(checkSettingsForm, 300);
+        });
+        
         // Save settings
         saveSettingsBtn.addEventListener('click', async () => {
+            if (settingsSaving) return;  // a save is already in flight
             try {
-                const settings = {
-                    host: document.getElementById('host').value.trim(),
-                    port: parseInt(document.getElementById('port').value),
-                    debug: document.getElementById('debug').checked,
-                    clipModel: document.getElementById('clipModel').value,
-                    minResults: parseInt(document.getElementById('minResults').value),
-                    maxResults: parseInt(document.getElementById('maxResults').value),
-                    defaultResults: parseInt(document.getElementById('defaultResults').value),
-                    batchSize: parseInt(document.getElementById('batchSize').value),
-                    thumbnailQuality: parseInt(document.getElementById('thumbnailQuality').value),
-                    maxCommentLength: parseInt(document.getElementById('maxCommentLength').value),
-                    maxFileSize: parseInt(document.getElementById('maxFileSize').value),
-                    indexFolderName: document.getElementById('indexFolderName').value.trim()
-                };
-                
-                // Basic validation
-                if (!settings.host) {
-                    showSettingsStatus('Host cannot be empty', 'error');
-                    return;
-                }
-                
-                if (settings.minResults >= settings.maxResults) {
-                    showSettingsStatus('Min results must be less than max results', 'error');
-                    return;
-                }
-                
-                if (settings.defaultResults < settings.minResults || settings.defaultResults > settings.maxResults) {
-                    showSettingsStatus('Default results must be between min and max results', 'error');
+                const settings = readSettings();
+                const error = validateSettings(settings);
+                if (error) {
+                    showSettingsStatus(error, 'error');
                     return;
                 }
                 
+                settingsSaving = true;
                 saveSettingsBtn.disabled = true;
                 saveSettingsBtn.textContent = 'Saving...';
                 
@@ -1255,6 +3070,7 @@ def home():
                 const data = await response.json();
                 
                 if (data.success) {
+                    cacheSettings(settings);
                     showSettingsStatus(data.message, 'success');
                 } else {
                     showSettingsStatus('Error saving settings: ' + data.error, 'error');
@@ -1263,37 +3079,29 @@ def home():
             } catch (error) {
                 showSettingsStatus('Error saving settings: ' + error.message, 'error');
             } finally {
-                saveSettingsBtn.disabled = false;
+                settingsSaving = false;
                 saveSettingsBtn.textContent = 'Save Settings';
+                checkSettingsForm();
             }
         });
         
         // Reset settings to defaults
         resetSettingsBtn.addEventListener('click', () => {
             if (confirm('Reset all settings to default values?')) {
-                document.getElementById('host').value = '0.0.0.0';
-                document.getElementById('port').value = '5000';
-                document.getElementById('debug').checked = false;
-                document.getElementById('clipModel').value = 'ViT-B/32';
-                document.getElementById('minResults').value = '3';
-                document.getElementById('maxResults').value = '48';
-                document.getElementById('defaultResults').value = '12';
-                document.getElementById('batchSize').value = '32';
-                document.getElementById('thumbnailQuality').value = '85';
-                document.getElementById('qualityValue').textContent = '85';
-                document.getElementById('maxCommentLength').value = '100';
-                document.getElementById('maxFileSize').value = '50';
-                document.getElementById('indexFolderName').value = '.clip_index';
+                fillSettings(Object.fromEntries(SETTINGS_FIELDS.map(field => [field.key, field.default])));
             }
         });
         
         // Show settings status message
+        let settingsStatusTimer = null;
         function showSettingsStatus(message, type) {
             settingsStatus.textContent = message;
             settingsStatus.className = `settings-status ${type}`;
             settingsStatus.style.display = 'block';
             
-            setTimeout(() => {
+            // Repeated saves restart the timer instead of stacking hides that cut later messages short
+            clearTimeout(settingsStatusTimer);
+            settingsStatusTimer = setTimeout(() => {
                 settingsStatus.style.display = 'none';
             }, 5000);
         }
@@ -1315,19 +3123,21 @@ def home():
             textSearchBox.style.display = 'none';
         });
         
-        // Check index status
-        async function checkIndexStatus(folder) {
-            try {
-                const response = await fetch('/check_index', {
+        // Check index status; concurrent checks of one folder share a single request
+        const indexChecks = new Map();
+        function checkIndexStatus(folder) {
+            if (!indexChecks.has(folder)) {
+                const check = fetch('/check_index', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ folder })
-                });
-                const data = await response.json();
-                return data.indexed;
-            } catch (error) {
-                return false;
+                })
+                    .then(response => response.json())
+                    .catch(() => ({ indexed: false }))
+                    .finally(() => indexChecks.delete(folder));
+                indexChecks.set(folder, check);
             }
+            return indexChecks.get(folder);
         }
         
         // Index folder
@@ -1335,6 +3145,7 @@ def home():
             const folder = folderInput.value.trim();
             if (!folder) return;
             
+            clearTimeout(indexCheckTimer);  // stop any status polling; this request reports the result
             indexStatus.textContent = 'Indexing...';
             indexStatus.className = 'status';
             indexBtn.disabled = true;
@@ -1361,7 +3172,33 @@ def home():
                 indexStatus.className = 'status error';
             } finally {
                 indexBtn.disabled = false;
+                lastCheckedFolder = null;  // the status line now reflects this run, not the last check
+            }
+        });
+        
+        // The request filling the results area: a newer one aborts it, an identical one while it runs is dropped
+        let resultsRequest = null;
+        
+        function startResultsRequest(key) {
+            if (resultsRequest) {
+                if (resultsRequest.key === key) return null;
+                resultsRequest.controller.abort();
             }
+            resultsRequest = { key, controller: new AbortController() };
+            return resultsRequest;
+        }
+        
+        function finishResultsRequest(request) {
+            if (resultsRequest === request) resultsRequest = null;
+        }
+        
+        // Escape cancels the running search; results streamed so far stay on the page
+        document.addEventListener('keydown', (e) => {
+            if (e.key !== 'Escape' || !resultsRequest || settingsModal.style.display === 'block') return;
+            const request = resultsRequest;
+            resultsRequest = null;
+            request.controller.abort();
+            if (!resultsContainer.querySelector('.result-item')) showResultsMessage('Search cancelled');
         });
         
         // Text search
@@ -1373,24 +3210,28 @@ def home():
             
             if (!query || !folder) return;
             
-            resultsContainer.innerHTML = '<div class="loading"><div class="spinner"></div> Searching...</div>';
+            const body = JSON.stringify({ folder, query, limit, sort_by: sortBy });
+            const request = startResultsRequest('search:' + body);
+            if (!request) return;
+            showResultsMessage('Searching...', true);
             
             try {
                 const response = await fetch('/search', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ folder, query, limit, sort_by: sortBy })
+                    body,
+                    signal: request.controller.signal
                 });
                 
-                const data = await response.json();
+                const count = await streamResults(response);
                 
-                if (data.results && data.results.length > 0) {
-                    displayResults(data.results);
-                } else {
-                    resultsContainer.innerHTML = '<div class="loading">No results found</div>';
+                if (count === 0) {
+                    showResultsMessage('No results found');
                 }
             } catch (error) {
-                resultsContainer.innerHTML = '<div class="loading">Error: ' + error.message + '</div>';
+                if (error.name !== 'AbortError') showResultsMessage('Error: ' + error.message);
+            } finally {
+                finishResultsRequest(request);
             }
         });
         
@@ -1408,7 +3249,10 @@ def home():
                 return;
             }
             
-            resultsContainer.innerHTML = '<div class="loading"><div class="spinner"></div> Searching by image...</div>';
+            const source = file ? `${file.name}|${file.size}|${file.lastModified}` : imagePathValue;
+            const request = startResultsRequest(`image:${folder}|${limit}|${sortBy}|${source}`);
+            if (!request) return;
+            showResultsMessage('Searching by image...', true);
             
             try {
                 const formData = new FormData();
@@ -1425,18 +3269,19 @@ def home():
                 
                 const response = await fetch('/search_by_image', {
                     method: 'POST',
-                    body: formData
+                    body: formData,
+                    signal: request.controller.signal
                 });
                 
-                const data = await response.json();
+                const count = await streamResults(response);
                 
-                if (data.results && data.results.length > 0) {
-                    displayResults(data.results);
-                } else {
-                    resultsContainer.innerHTML = '<div class="loading">No results found</div>';
+                if (count === 0) {
+                    showResultsMessage('No results found');
                 }
             } catch (error) {
-                resultsContainer.innerHTML = '<div class="loading">Error: ' + error.message + '</div>';
+                if (error.name !== 'AbortError') showResultsMessage('Error: ' + error.message);
+            } finally {
+                finishResultsRequest(request);
             }
         });
         
@@ -1449,13 +3294,16 @@ def home():
                 return;
             }
             
-            resultsContainer.innerHTML = '<div class="loading"><div class="spinner"></div> Loading commented images...</div>';
+            const request = startResultsRequest('commented:' + folder);
+            if (!request) return;
+            showResultsMessage('Loading commented images...', true);
             
             try {
                 const response = await fetch('/commented_images', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ folder })
+                    body: JSON.stringify({ folder }),
+                    signal: request.controller.signal
                 });
                 
                 const data = await response.json();
@@ -1463,163 +3311,320 @@ def home():
                 if (data.results && data.results.length > 0) {
                     displayCommentedResults(data.results);
                 } else {
-                    resultsContainer.innerHTML = '<div class="loading">No commented images found</div>';
+                    showResultsMessage('No commented images found');
                 }
             } catch (error) {
-                resultsContainer.innerHTML = '<div class="loading">Error: ' + error.message + '</div>';
+                if (error.name !== 'AbortError') showResultsMessage('Error: ' + error.message);
+            } finally {
+                finishResultsRequest(request);
             }
         });
         
-        // Generate common HTML structure for result items
-        function generateResultItemHTML(result, index, isCommented = false) {
-            const similarityText = isCommented 
-                ? `Comments: ${result.comment_count} | Latest: ${result.latest_comment.substring(0, 50)}${result.latest_comment.length > 50 ? '...' : ''}`
-                : `Similarity: ${(result.similarity * 100).toFixed(1)}%`;
-                
-            return `
-                <div class="image-container">
-                    <img src="data:image/jpeg;base64,${result.thumbnail}" class="thumbnail" alt="" />
-                    <div class="image-overlay">
-                        <div class="expand-collapse-icon" data-index="${index}">
-                            <svg xmlns="http://www.w3.org/2000/svg" height="20px" viewBox="0 -960 960 960" width="20px" fill="#e3e3e3">
-                                <path d="M240-240v-240h72v168h168v72H240Zm408-240v-168H480v-72h240v240h-72Z"/>
-                            </svg>
-                        </div>
-                        <div class="find-similar-icon" data-index="${index}" data-path="${result.path}" style="display: none;">
-                            <svg xmlns="http://www.w3.org/2000/svg" height="20px" viewBox="0 -960 960 960" width="20px" fill="#e3e3e3">
-                                <path d="M784-120 532-372q-30 24-69 38t-83 14q-109 0-184.5-75.5T120-580q0-109 75.5-184.5T380-840q109 0 184.5 75.5T640-580q0 44-14 83t-38 69l252 252-56 56ZM380-400q75 0 127.5-52.5T560-580q0-75-52.5-127.5T380-760q-75 0-127.5 52.5T200-580q0 75 52.5 127.5T380-400Z"/>
-                            </svg>
-                        </div>
-                    </div>
-                </div>
-                <div class="result-info">
-                    <div class="filename">
-                        ${result.filename}
-                        <svg class="copy-icon" xmlns="http://www.w3.org/2000/svg" height="16px" viewBox="0 -960 960 960" width="16px" fill="#888">
-                            <path d="M360-240q-29.7 0-50.85-21.15Q288-282.3 288-312v-480q0-29.7 21.15-50.85Q330.3-864 360-864h384q29.7 0 50.85 21.15Q816-821.7 816-792v480q0 29.7-21.15 50.85Q773.7-240 744-240H360Zm0-72h384v-480H360v480ZM216-96q-29.7 0-50.85-21.15Q144-138.3 144-168v-552h72v552h456v72H216Zm144-216v-480 480Z"/>
-                        </svg>
-                    </div>
-                    <div class="similarity">${similarityText}</div>
-                </div>
-                <div class="comment-section">
-                    <div class="comments-list" id="comments-${index}">
-                        <div class="comment-loading">Loading comments...</div>
-                    </div>
-                    <div class="comment-form">
-                        <textarea class="comment-input" placeholder="Add a comment..." id="comment-input-${index}"></textarea>
-                        <button class="save-comment-btn" id="save-btn-${index}">Save</button>
-                    </div>
-                </div>
-            `;
+        // Status line in place of the results (spinner while waiting); plain text, never parsed as HTML
+        function showResultsMessage(text, spinner = false) {
+            const message = document.createElement('div');
+            message.className = 'loading';
+            if (spinner) message.append(createTextDiv('spinner', ''), ' ');
+            message.append(text);
+            resultsContainer.replaceChildren(message);
         }
 
-        // Setup event handlers for result item
-        function setupResultItemEventHandlers(item, result, index) {
-            // Handle expand/collapse via overlay icon
-            const expandCollapseIcon = item.querySelector('.expand-collapse-icon');
-            expandCollapseIcon.addEventListener('click', (e) => {
-                e.stopPropagation();
-                toggleImageExpansion(item, result, index);
-            });
-            
-            // Handle copy icon click
-            const copyIcon = item.querySelector('.copy-icon');
-            copyIcon.addEventListener('click', (e) => {
-                e.stopPropagation();
-                copyImagePath(result.path);
-            });
+        // Rendered results by item index; one delegated listener handles every item's buttons
+        let currentResults = [];
+        resultsContainer.addEventListener('click', (e) => {
+            const target = e.target.closest('[data-action]');
+            const item = target && target.closest('.result-item');
+            if (!item) return;
+            e.stopPropagation();
+            const index = Number(item.dataset.index);
+            const result = currentResults[index];
             
+            switch (target.dataset.action) {
+                case 'expand':
+                    toggleImageExpansion(item, result);
+                    break;
+                case 'copy':
+                    copyImagePath(result.path, target);
+                    break;
+                case 'find-similar':
+                    findSimilarImages(result.path);
+                    break;
+                case 'save-comment':
+                    saveComment(item, result.path, folderInput.value.trim());
+                    break;
+            }
+        });
+
+        // Enter in a comment box saves it like the Save button (Shift+Enter adds a line; IME composition is left alone)
+        resultsContainer.addEventListener('keydown', (e) => {
+            if (e.key !== 'Enter' || e.shiftKey || e.isComposing || !e.target.matches('.comment-input')) return;
+            e.preventDefault();
+            if (e.repeat) return;
+            const item = e.target.closest('.result-item');
+            saveComment(item, currentResults[Number(item.dataset.index)].path, folderInput.value.trim());
+        });
+
+        // Only the first RESULTS_WINDOW items get DOM nodes; another window is rendered each time the
+        // sentinel after the last item comes within a viewport of the screen, so long result lists
+        // cost nothing until scrolled to
+        const RESULTS_WINDOW = 24;
+        let renderedCount = 0;
+        let renderLimit = RESULTS_WINDOW;
+        let renderCommented = false;
+        const resultsSentinel = document.createElement('div');
+        resultsSentinel.className = 'results-sentinel';
+        const sentinelObserver = new IntersectionObserver((entries) => {
+            if (!entries.some(entry => entry.isIntersecting) || renderedCount >= currentResults.length) return;
+            renderLimit = renderedCount + RESULTS_WINDOW;
+            renderPendingResults();
+        }, { rootMargin: '100% 0px' });
+        sentinelObserver.observe(resultsSentinel);
+        
+        // Append items for results that arrived but aren't rendered yet, up to the current window
+        function renderPendingResults() {
+            const end = Math.min(currentResults.length, renderLimit);
+            // Build the items off-document, then insert them with one layout pass
+            const fragment = document.createDocumentFragment();
+            for (; renderedCount < end; renderedCount++) {
+                fragment.appendChild(createResultItem(currentResults[renderedCount], renderedCount, renderCommented));
+            }
+            resultsSentinel.before(fragment);
+            if (renderedCount < currentResults.length) {
+                // Results are held back: re-observe for a fresh reading, as the sentinel may still be in range
+                sentinelObserver.unobserve(resultsSentinel);
+                sentinelObserver.observe(resultsSentinel);
+            }
+        }
+        
+        // Replace the results area with a new list (results may keep arriving via currentResults.push)
+        function displayResults(results, isCommented = false) {
+            currentResults = results;
+            renderedCount = 0;
+            renderLimit = RESULTS_WINDOW;
+            renderCommented = isCommented;
+            resultsContainer.replaceChildren(resultsSentinel);
+            renderPendingResults();
+        }
+        
+        const resultTemplate = document.getElementById('result-template').content.firstElementChild;
+        const commentSectionTemplate = document.getElementById('comment-section-template').content.firstElementChild;
+        const commentTemplate = document.getElementById('comment-template').content.firstElementChild;
+        
+        function createResultItem(result, index, isCommented) {
+            const item = resultTemplate.cloneNode(true);
+            item.dataset.index = index;
+            item.querySelector('.thumbnail').src = result.thumbnail_url;
+            item.querySelector('.filename').prepend(result.filename);  // text node before the copy icon
             
-            // Handle find similar button
-            const findSimilarIcon = item.querySelector('.find-similar-icon');
-            findSimilarIcon.addEventListener('click', (e) => {
-                e.stopPropagation();
-                findSimilarImages(result.path);
-            });
+            const similarity = item.querySelector('.similarity');
+            similarity.textContent = isCommented
+                ? `Comments: ${result.comment_count} | Latest: ${result.latest_comment.substring(0, 50)}${result.latest_comment.length > 50 ? '...' : ''}`
+                : `Similarity: ${(result.similarity * 100).toFixed(1)}%`;
+            const duplicates = result.duplicates || [];
+            if (duplicates.length > 0) {
+                const span = document.createElement('span');
+                span.className = 'duplicates';
+                span.title = duplicates.join('\\n');
+                span.textContent = `+${duplicates.length} near-duplicate${duplicates.length > 1 ? 's' : ''}`;
+                similarity.append(' ', span);
+            }
+            return item;
+        }
+        
+        // Render NDJSON search results as each line arrives; returns the number of results
+        async function streamResults(response) {
+            const contentType = response.headers.get('Content-Type') || '';
+            if (!contentType.includes('application/x-ndjson')) {
+                const data = await response.json();
+                throw new Error(data.error || 'Unknown error');
+            }
             
-            // Add save comment functionality
-            const saveBtn = item.querySelector(`#save-btn-${index}`);
-            const commentInput = item.querySelector(`#comment-input-${index}`);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let count = 0;
+            let spinner = null;
             
-            saveBtn.addEventListener('click', () => {
-                saveComment(index, result.path, folderInput.value.trim(), commentInput.value.trim());
-            });
-        }
-
-        // Display results
-        function displayResults(results) {
-            resultsContainer.innerHTML = '';
+            // Results that arrived in one network chunk are inserted together
+            const handleLines = (lines) => {
+                const results = lines.filter(line => line.trim()).map(line => JSON.parse(line));
+                if (results.length === 0) return;
+                if (!spinner) {
+                    // First results replace the previous page; keep a spinner until the stream ends
+                    displayResults([]);
+                    spinner = document.createElement('div');
+                    spinner.className = 'loading';
+                    spinner.appendChild(createTextDiv('spinner', ''));
+                    resultsContainer.append(spinner);
+                }
+                currentResults.push(...results);
+                count += results.length;
+                renderPendingResults();
+            };
             
-            results.forEach((result, index) => {
-                const item = document.createElement('div');
-                item.className = 'result-item';
-                item.innerHTML = generateResultItemHTML(result, index, false);
-                
-                setupResultItemEventHandlers(item, result, index);
-                resultsContainer.appendChild(item);
-            });
+            try {
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    handleLines(lines);
+                }
+                handleLines([buffer + decoder.decode()]);
+            } finally {
+                if (spinner) spinner.remove();
+            }
+            return count;
         }
         
         // Display commented results (similar to displayResults but with comment info)
         function displayCommentedResults(results) {
-            resultsContainer.innerHTML = '';
-            
-            results.forEach((result, index) => {
-                const item = document.createElement('div');
-                item.className = 'result-item';
-                item.innerHTML = generateResultItemHTML(result, index, true);
-                
-                setupResultItemEventHandlers(item, result, index);
-                resultsContainer.appendChild(item);
-            });
+            displayResults(results, true);
         }
         
-        // Comment functionality
-        async function loadComments(index, imagePath, folder) {
-            const commentsContainer = document.getElementById(`comments-${index}`);
-            
+        // Comment functionality: loads requested within 50ms share one /comments/batch request
+        let pendingCommentLoads = [];
+        let commentLoadTimer = null;
+        
+        // Comments by "folder|path", kept for a minute in memory and in localStorage (across reloads)
+        const COMMENT_CACHE_TTL = 60 * 1000;
+        const commentCache = new Map();
+        
+        function getCachedComments(folder, imagePath) {
+            const key = `${folder}|${imagePath}`;
+            let entry = commentCache.get(key);
+            if (!entry) {
+                try {
+                    entry = JSON.parse(localStorage.getItem('cmt:' + key));
+                } catch (error) {
+                    entry = null;  // storage disabled or entry corrupt
+                }
+            }
+            if (entry && Date.now() - entry.ts < COMMENT_CACHE_TTL) return entry.data;
+            if (entry) {
+                commentCache.delete(key);
+                try {
+                    localStorage.removeItem('cmt:' + key);
+                } catch (error) {
+                    // storage disabled
+                }
+            }
+            return null;
+        }
+        
+        function cacheComments(folder, imagePath, comments) {
+            const key = `${folder}|${imagePath}`;
+            const entry = { data: comments, ts: Date.now() };
+            commentCache.set(key, entry);
             try {
-                const response = await fetch(`/comments?folder=${encodeURIComponent(folder)}&image_path=${encodeURIComponent(imagePath)}`);
-                const data = await response.json();
+                localStorage.setItem('cmt:' + key, JSON.stringify(entry));
+            } catch (error) {
+                // Storage full or disabled; the in-memory copy still serves this page
+            }
+        }
+        
+        function showComments(list, comments) {
+            if (comments.length > 0) {
+                displayComments(list, comments);
+            } else {
+                list.replaceChildren(createTextDiv('no-comments', 'No comments yet. Be the first to add one!'));
+            }
+        }
+        
+        function loadComments(list, imagePath, folder) {
+            const cached = getCachedComments(folder, imagePath);
+            if (cached) {
+                showComments(list, cached);
+                return;
+            }
+            pendingCommentLoads.push({ list, imagePath, folder });
+            if (!commentLoadTimer) {
+                commentLoadTimer = setTimeout(flushCommentLoads, 50);
+            }
+        }
+        
+        async function flushCommentLoads() {
+            const loads = pendingCommentLoads;
+            pendingCommentLoads = [];
+            commentLoadTimer = null;
+            
+            // One request per folder (normally just one)
+            const byFolder = new Map();
+            loads.forEach(load => {
+                if (!byFolder.has(load.folder)) byFolder.set(load.folder, []);
+                byFolder.get(load.folder).push(load);
+            });
+            
+            for (const [folder, folderLoads] of byFolder) {
+                let comments = null;
+                try {
+                    const response = await fetch('/comments/batch', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ folder, image_paths: [...new Set(folderLoads.map(load => load.imagePath))] })
+                    });
+                    const data = await response.json();
+                    if (!response.ok) throw new Error(data.error);
+                    comments = data.comments;
+                } catch (error) {
+                    console.error('Error loading comments:', error);
+                }
                 
-                if (data.comments && data.comments.length > 0) {
-                    displayComments(commentsContainer, data.comments);
-                } else {
-                    commentsContainer.innerHTML = '<div class="no-comments">No comments yet. Be the first to add one!</div>';
+                if (comments) {
+                    folderLoads.forEach(({ imagePath }) => cacheComments(folder, imagePath, comments[imagePath] || []));
                 }
-            } catch (error) {
-                console.error('Error loading comments:', error);
-                commentsContainer.innerHTML = '<div class="no-comments">Error loading comments</div>';
+                folderLoads.forEach(({ list: commentsContainer, imagePath }) => {
+                    if (!commentsContainer.isConnected) return;  // results were replaced meanwhile
+                    if (!comments) {
+                        commentsContainer.replaceChildren(createTextDiv('no-comments', 'Error loading comments'));
+                    } else {
+                        showComments(commentsContainer, comments[imagePath] || []);
+                    }
+                });
             }
         }
         
+        // "[timestamp] text" as stored by the server -> [timestamp, text] (null without a timestamp)
+        function splitComment(comment) {
+            if (comment[0] !== '[') return null;
+            const end = comment.indexOf('] ');
+            return end === -1 ? null : [comment.slice(1, end), comment.slice(end + 2)];
+        }
+        
+        function createTextDiv(className, text) {
+            const div = document.createElement('div');
+            div.className = className;
+            div.textContent = text;  // no HTML parsing, so no escaping needed
+            return div;
+        }
+        
         function displayComments(container, comments) {
-            container.innerHTML = '';
+            const fragment = document.createDocumentFragment();
             comments.forEach(comment => {
-                const commentDiv = document.createElement('div');
-                commentDiv.className = 'comment-item';
+                const commentDiv = commentTemplate.cloneNode(true);
+                const timestamp = commentDiv.firstChild;
                 
-                // Parse timestamp and comment text
-                const timestampMatch = comment.match(/^\\[(.*?)\\] (.*)$/);
-                if (timestampMatch) {
-                    const [, timestamp, text] = timestampMatch;
-                    commentDiv.innerHTML = `
-                        <div class="comment-timestamp">${timestamp}</div>
-                        <div class="comment-text">${escapeHtml(text)}</div>
-                    `;
+                // Parse timestamp and comment text (textContent: no HTML parsing, so no escaping needed)
+                const parts = splitComment(comment);
+                if (parts) {
+                    timestamp.textContent = parts[0];
+                    timestamp.nextSibling.textContent = parts[1];
                 } else {
-                    commentDiv.innerHTML = `<div class="comment-text">${escapeHtml(comment)}</div>`;
+                    timestamp.nextSibling.textContent = comment;
+                    timestamp.remove();
                 }
                 
-                container.appendChild(commentDiv);
+                fragment.appendChild(commentDiv);
             });
+            container.replaceChildren(fragment);
         }
         
-        async function saveComment(index, imagePath, folder, comment) {
-            if (!comment) return;
-            
-            const saveBtn = document.getElementById(`save-btn-${index}`);
-            const commentInput = document.getElementById(`comment-input-${index}`);
+        async function saveComment(item, imagePath, folder) {
+            const saveBtn = item.querySelector('.save-comment-btn');
+            const commentInput = item.querySelector('.comment-input');
+            const comment = commentInput.value.trim();
+            if (!comment || saveBtn.disabled) return;  // one save in flight per item
             
             // Disable button during save
             saveBtn.disabled = true;
@@ -1641,8 +3646,8 @@ def home():
                 if (data.success) {
                     // Clear input and reload comments
                     commentInput.value = '';
-                    const commentsContainer = document.getElementById(`comments-${index}`);
-                    displayComments(commentsContainer, data.comments);
+                    cacheComments(folder, imagePath, data.comments);
+                    displayComments(item.querySelector('.comments-list'), data.comments);
                 } else {
                     alert('Error saving comment: ' + (data.error || 'Unknown error'));
                 }
@@ -1656,67 +3661,77 @@ def home():
             }
         }
         
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
+        // DOM writes queued from event handlers and applied together in the next animation frame
+        let frameWrites = [];
+        
+        function scheduleWrite(write) {
+            if (frameWrites.length === 0) {
+                requestAnimationFrame(() => {
+                    const writes = frameWrites;
+                    frameWrites = [];
+                    writes.forEach(w => w());
+                });
+            }
+            frameWrites.push(write);
         }
         
-        function toggleImageExpansion(item, result, index) {
-            const img = item.querySelector('.thumbnail');
-            const expandCollapseIcon = item.querySelector('.expand-collapse-icon');
-            const isExpanded = item.classList.contains('expanded');
+        function toggleImageExpansion(item, result) {
+            // State lives on the item so toggles queued within one frame still alternate
+            const expand = !item.expandedState;
+            item.expandedState = expand;
             
-            if (isExpanded) {
-                // Collapse: switch back to thumbnail
-                img.src = `data:image/jpeg;base64,${result.thumbnail}`;
-                item.classList.remove('expanded');
-                // Update icon to expand
-                expandCollapseIcon.innerHTML = `
-                    <svg xmlns="http://www.w3.org/2000/svg" height="20px" viewBox="0 -960 960 960" width="20px" fill="#e3e3e3">
-                        <path d="M240-240v-240h72v168h168v72H240Zm408-240v-168H480v-72h240v240h-72Z"/>
-                    </svg>
-                `;
-            } else {
-                // Expand: show original image and load comments
-                const originalImageUrl = `/image/${encodeURIComponent(result.path)}`;
-                img.src = originalImageUrl;
-                item.classList.add('expanded');
-                loadComments(index, result.path, folderInput.value.trim());
-                // Update icon to collapse
-                expandCollapseIcon.innerHTML = `
-                    <svg xmlns="http://www.w3.org/2000/svg" height="20px" viewBox="0 -960 960 960" width="20px" fill="#e3e3e3">
-                        <path d="M432-432v240h-72v-168H192v-72h240Zm168-336v168h168v72H528v-240h72Z"/>
-                    </svg>
-                `;
+            if (expand) {
+                // Ask for comments now; they render whenever they arrive
+                if (!item.querySelector('.comment-section')) {
+                    item.appendChild(commentSectionTemplate.cloneNode(true));
+                }
+                loadComments(item.querySelector('.comments-list'), result.path, folderInput.value.trim());
             }
+            scheduleWrite(() => {
+                if (item.expandedState !== expand) return;  // toggled back before the frame
+                // Original image while expanded, thumbnail otherwise; CSS swaps the icon with the class
+                item.querySelector('.thumbnail').src = expand ? `/image/${encodeURIComponent(result.path)}` : result.thumbnail_url;
+                item.classList.toggle('expanded', expand);
+            });
         }
         
         
-        async function copyImagePath(imagePath) {
+        // Clipboard API availability can't change while the page is open
+        const HAS_CLIPBOARD = !!(navigator.clipboard && window.isSecureContext);
+        let clipboardFallback = null;  // off-screen textarea, created on first use and kept for later copies
+        
+        function copyWithFallback(text) {
+            // Off-screen textarea + execCommand, for plain-HTTP network access and older browsers
+            if (!clipboardFallback) {
+                clipboardFallback = document.createElement('textarea');
+                clipboardFallback.style.cssText = 'position:fixed;left:-999999px;top:-999999px';
+                clipboardFallback.setAttribute('readonly', '');
+                clipboardFallback.setAttribute('aria-hidden', 'true');
+                clipboardFallback.tabIndex = -1;
+                document.body.appendChild(clipboardFallback);
+            }
+            const focused = document.activeElement;
+            clipboardFallback.value = text;
+            clipboardFallback.focus();
+            clipboardFallback.select();
+            const copied = document.execCommand('copy');
+            if (focused && focused !== document.body) focused.focus();  // don't leave focus on the hidden textarea
+            if (!copied) throw new Error('copy command refused');
+        }
+        
+        async function copyImagePath(imagePath, icon) {
             try {
-                const textToCopy = imagePath;
-                
-                if (navigator.clipboard && window.isSecureContext) {
-                    // Use modern clipboard API
-                    await navigator.clipboard.writeText(textToCopy);
-                } else {
-                    // Fallback for older browsers
-                    const textArea = document.createElement('textarea');
-                    textArea.value = textToCopy;
-                    textArea.style.position = 'fixed';
-                    textArea.style.left = '-999999px';
-                    textArea.style.top = '-999999px';
-                    document.body.appendChild(textArea);
-                    textArea.focus();
-                    textArea.select();
-                    document.execCommand('copy');
-                    textArea.remove();
+                try {
+                    if (!HAS_CLIPBOARD) throw new Error('Clipboard API unavailable');
+                    await navigator.clipboard.writeText(imagePath);  // async, no DOM or selection changes
+                } catch (error) {
+                    copyWithFallback(imagePath);  // e.g. permission denied or document not focused
+                }
+                if (icon) {
+                    // Flash the icon green as confirmation
+                    icon.classList.add('copied');
+                    setTimeout(() => icon.classList.remove('copied'), 1000);
                 }
-                
-                // Simple console feedback for now (could add toast notification)
-                console.log('Copied to clipboard:', imagePath);
-                
             } catch (error) {
                 console.error('Failed to copy:', error);
             }
@@ -1732,13 +3747,16 @@ def home():
                 return;
             }
             
+            const request = startResultsRequest(`similar:${folder}|${limit}|${sortBy}|${imagePath}`);
+            if (!request) return;
+            
             // Show loading state
             indexStatus.textContent = 'Finding similar images...';
             indexStatus.className = 'status';
             
             try {
                 // Fetch the image file from the server using existing image route
-                const imageResponse = await fetch(`/image/${encodeURIComponent(imagePath)}`);
+                const imageResponse = await fetch(`/image/${encodeURIComponent(imagePath)}`, { signal: request.controller.signal });
                 if (!imageResponse.ok) {
                     throw new Error('Failed to load image file');
                 }
@@ -1756,88 +3774,268 @@ def home():
                 // Call existing search_by_image endpoint
                 const response = await fetch('/search_by_image', {
                     method: 'POST',
-                    body: formData
+                    body: formData,
+                    signal: request.controller.signal
                 });
                 
-                const data = await response.json();
+                const count = await streamResults(response);
                 
-                if (data.results) {
-                    if (data.results.length === 0) {
-                        indexStatus.textContent = 'No similar images found';
-                        indexStatus.className = 'status warning';
-                    } else {
-                        indexStatus.textContent = `Found ${data.results.length} similar images`;
-                        indexStatus.className = 'status success';
-                        displayResults(data.results);
-                    }
+                if (count === 0) {
+                    indexStatus.textContent = 'No similar images found';
+                    indexStatus.className = 'status warning';
                 } else {
-                    throw new Error(data.error || 'Unknown error');
+                    indexStatus.textContent = `Found ${count} similar images`;
+                    indexStatus.className = 'status success';
                 }
             } catch (error) {
+                if (error.name === 'AbortError') {
+                    // Superseded; a newer find-similar has already put up its own status
+                    if (!resultsRequest || !resultsRequest.key.startsWith('similar:')) {
+                        indexStatus.textContent = '';
+                        indexStatus.className = 'status';
+                    }
+                    return;
+                }
                 console.error('Find similar error:', error);
                 indexStatus.textContent = 'Error finding similar images: ' + error.message;
                 indexStatus.className = 'status error';
+            } finally {
+                finishResultsRequest(request);
             }
         }
         
         // Enter key support
+        // Held-down Enter repeats keypress; only the first press submits
         searchInput.addEventListener('keypress', (e) => {
-            if (e.key === 'Enter') searchBtn.click();
+            if (e.key === 'Enter' && !e.repeat) searchBtn.click();
         });
         
         folderInput.addEventListener('keypress', (e) => {
-            if (e.key === 'Enter') indexBtn.click();
+            if (e.key === 'Enter' && !e.repeat) indexBtn.click();
         });
         
-        // Check index on folder change
-        folderInput.addEventListener('blur', async () => {
-            const folder = folderInput.value.trim();
-            if (folder) {
-                const indexed = await checkIndexStatus(folder);
-                if (indexed) {
-                    indexStatus.textContent = 'Folder is indexed';
-                    indexStatus.className = 'status success';
-                } else {
-                    indexStatus.textContent = 'Folder not indexed';
-                    indexStatus.className = 'status';
-                }
+        // Check index on folder change, debounced so tabbing in and out doesn't re-check an unchanged folder
+        let lastCheckedFolder = null;
+        let indexCheckTimer = null;
+        
+        // Show a folder's index status; while a job is pending, poll every 2s until it finishes
+        async function refreshIndexStatus(folder) {
+            const status = await checkIndexStatus(folder);
+            // A later folder or an Index click owns the status line now
+            if (folderInput.value.trim() !== folder || indexBtn.disabled) return;
+            lastCheckedFolder = folder;
+            if (status.pending) {
+                indexStatus.textContent = 'Indexing in progress...';
+                indexStatus.className = 'status';
+                indexCheckTimer = setTimeout(() => refreshIndexStatus(folder), 2000);
+            } else if (status.indexed) {
+                indexStatus.textContent = 'Folder is indexed';
+                indexStatus.className = 'status success';
+            } else {
+                indexStatus.textContent = 'Folder not indexed';
+                indexStatus.className = 'status';
             }
+        }
+        
+        folderInput.addEventListener('blur', () => {
+            const folder = folderInput.value.trim();
+            if (!folder || folder === lastCheckedFolder) return;
+            clearTimeout(indexCheckTimer);
+            indexCheckTimer = setTimeout(() => refreshIndexStatus(folder), 250);
         });
     </script>
 </body>
 </html>
     '''
     
-    # Replace the placeholder with actual options and timestamp
-    current_timestamp = str(int(time.time()))
-    response_html = html_template.replace('{result_options_html}', result_options_html)
-    response_html = response_html.replace('{timestamp}', current_timestamp)
+    # Replace the placeholder with actual options; no per-start cache buster, so the ETag
+    # (a hash of the page) stays valid across restarts and browsers get 304s
+    return html_template.replace('{result_options_html}', result_options_html)
+
+def compress_asset(body):
+    """Precompressed copies of a frontend file by Content-Encoding (brotli when installed, gzip always)"""
+    encodings = {'gzip': gzip.compress(body, 9)}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body, quality=11)
+    return encodings
+
+@functools.lru_cache(maxsize=1)
+def home_page():
+    """Frontend page bytes, its compressed copies and their ETags by encoding, plus the CSS/JS split out of it
+    
+    The inline <style> and <script> become files named by their content hash ({name: (bytes, compressed,
+    content type)}), so browsers cache them for good and a reload only revalidates the small page.
+    """
+    html = render_home()
+    assets = {}
+    for open_tag, close_tag, ext, content_type, tag in (
+            ('<style>', '</style>', 'css', 'text/css; charset=utf-8', '<link rel="stylesheet" href="/assets/{}">'),
+            ('<script>', '</script>', 'js', 'text/javascript; charset=utf-8', '<script src="/assets/{}"></script>')):
+        start = html.index(open_tag)
+        end = html.index(close_tag, start)
+        body = html[start + len(open_tag):end].encode('utf-8')
+        name = f'app.{hashlib.sha1(body).hexdigest()[:12]}.{ext}'
+        assets[name] = (body, compress_asset(body), content_type)
+        html = html[:start] + tag.format(name) + html[end + len(close_tag):]
     
-    # Create response with cache-busting headers
-    response = make_response(response_html)
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache' 
-    response.headers['Expires'] = '0'
+    html = html.encode('utf-8')
+    encodings = compress_asset(html)
+    etag = hashlib.sha1(html).hexdigest()
+    etags = {None: etag, **{encoding: f'{etag}-{encoding}' for encoding in encodings}}
+    return html, encodings, etags, assets
+
+# Render and compress the page at import, so neither the first visitor nor a fresh WSGI worker pays for it
+home_page()
+
+def compressed_response(body, encodings):
+    """Response with the best precompressed encoding the client accepts"""
+    for encoding in ('br', 'gzip'):
+        if encoding in encodings and request.accept_encodings[encoding]:
+            response = make_response(encodings[encoding])
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        encoding = None
+        response = make_response(body)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response, encoding
+
+@app.route('/')
+def home():
+    """Serve the frontend"""
+    html, encodings, etags, _ = home_page()
+    response, encoding = compressed_response(html, encodings)
     
+    # Browsers revalidate every load; the ETag only changes when the page itself does
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etags[encoding])
+    return response.make_conditional(request)
+
+@app.route('/assets/<name>')
+def serve_asset(name):
+    """Serve the frontend's CSS/JS; names carry a content hash, so they never change"""
+    asset = home_page()[3].get(name)
+    if asset is None:
+        return "Asset not found", 404
+    body, encodings, content_type = asset
+    response, _ = compressed_response(body, encodings)
+    response.headers['Content-Type'] = content_type
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     return response
 
+def image_root(abs_path):
+    """Indexed folder that contains abs_path (registered as its results are served, or indexed on disk), or None"""
+    for folder in list(thumb_folders.values()):
+        root = os.path.normcase(os.path.realpath(folder))
+        try:
+            if os.path.commonpath([os.path.normcase(abs_path), root]) == root:
+                return root
+        except ValueError:
+            continue  # different drives on Windows
+    
+    # No results of the folder served by this process yet (e.g. a page left open across a restart):
+    # indexed images sit directly in their folder, so check for its index on disk
+    folder = os.path.dirname(abs_path)
+    if os.path.isfile(os.path.join(folder, config.INDEX_FOLDER_NAME, 'index.faiss')):
+        return os.path.normcase(folder)
+    return None
+
 @app.route('/image/<path:filepath>')
 def serve_image(filepath):
     """Serve original images"""
     try:
-        # Security check - prevent directory traversal
-        if '..' in filepath or filepath.startswith('/'):
+        # Werkzeug merges away the leading slash of POSIX absolute paths (/image//home/... -> /image/home/...)
+        if os.name != 'nt' and not filepath.startswith('/'):
+            filepath = '/' + filepath
+        
+        # Security check - only image files inside an indexed folder (symlinks resolved, so no way out)
+        abs_path = os.path.realpath(filepath)
+        if Path(abs_path).suffix.lower() not in config.SUPPORTED_EXTENSIONS or image_root(abs_path) is None:
             return "Access denied", 403
         
-        # Convert to absolute path and check if file exists
-        abs_path = os.path.abspath(filepath)
-        if not os.path.exists(abs_path) or not os.path.isfile(abs_path):
+        try:
+            if not stat.S_ISREG(os.stat(abs_path).st_mode):
+                return "Image not found", 404
+        except OSError:
             return "Image not found", 404
-            
-        return send_file(abs_path)
+        
+        # ETag/Last-Modified revalidation: unchanged originals come back as 304s, edited ones are re-sent
+        return send_file(abs_path, conditional=True)
     except Exception as e:
         return f"Error serving image: {str(e)}", 500
 
+@app.route('/thumb/<token>/<int:row>.jpg')
+@app.route('/thumb/<token>/<int:row>.webp')
+def serve_thumbnail(token, row):
+    """Serve a cached index thumbnail, creating it on the fly if missing"""
+    folder = thumb_folders.get(token)
+    if folder is None:
+        return "Thumbnail not found", 404
+    
+    thumbs_path = Path(folder) / config.INDEX_FOLDER_NAME / 'thumbs'
+    thumb_path = thumbs_path / f'{row}{THUMBNAIL_EXTENSION}'
+    key = index_cache_key(folder)
+    version = request.args.get('v')
+    if not thumbnail_version_current(key, version):
+        # Rows from before a re-index; the file under this row now shows another image
+        return "Thumbnail not found", 404
+    with pending_thumbnails_lock:
+        job = pending_thumbnails.get(thumb_path)
+    if job is not None:
+        job.result()  # a stale thumbnail being rebuilt for this search must not be served (or cached) meanwhile
+    try:
+        return send_thumbnail(thumb_path)
+    except FileNotFoundError:
+        pass
+    
+    # Only a missing thumbnail needs the index
+    with index_cache_lock:
+        lock = folder_lock(key)
+    with lock:
+        # Rows and the thumbnails directory only change together under this lock (save_index swaps them)
+        index, image_paths, _ = load_index(folder)
+        if index is None or row >= len(image_paths) or not thumbnail_version_current(key, version):
+            return "Thumbnail not found", 404
+        try:
+            return send_thumbnail(thumb_path)  # swapped in by a re-index meanwhile
+        except FileNotFoundError:
+            pass
+        thumbs_path.mkdir(exist_ok=True)
+        with pending_thumbnails_lock:
+            thumbnail_sources.pop(thumb_path, None)  # whatever it was built from, it is gone now
+        job = ensure_thumbnail(image_paths[row], thumb_path)
+    if job is not None:
+        job.result()
+    try:
+        return send_thumbnail(thumb_path)
+    except FileNotFoundError:
+        return "Thumbnail not found", 404
+
+def thumbnail_version_current(key, version):
+    """Whether a thumbnail URL's index version (?v=) is the folder's loaded index (True if it isn't loaded to compare)"""
+    with index_cache_lock:
+        cached = index_cache.get(key)
+    return cached is None or version is None or version == str(cached[0])
+
+def send_thumbnail(thumb_path):
+    """Response for a thumbnail file; revalidations are answered from a stat, without opening the file"""
+    stat_result = os.stat(thumb_path)  # FileNotFoundError for a missing thumbnail
+    etag = f'{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}'
+    last_modified = datetime.fromtimestamp(stat_result.st_mtime, timezone.utc)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        # The path is built from the registered folder and an integer row, so send_from_directory's checks are not needed
+        response = send_file(thumb_path, conditional=False, etag=etag, last_modified=last_modified, max_age=31536000)
+    else:
+        # send_file opens the file before it checks the request's conditions
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+    # URLs carry the index version and a row's thumbnail never changes within one version
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/comments', methods=['GET'])
 def get_comments():
     """Get comments for a specific image"""
@@ -1851,7 +4049,22 @@ def get_comments():
         comments = get_image_comments(folder, image_path)
         return jsonify({'comments': comments})
     except Exception as e:
-        print(f"Error getting comments: {e}")
+        logger.exception("Error getting comments")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/comments/batch', methods=['POST'])
+def get_comments_batch():
+    """Get comments for several images in one request"""
+    folder = request.json.get('folder')
+    image_paths = request.json.get('image_paths')
+    
+    if not folder or not isinstance(image_paths, list) or not all(isinstance(p, str) for p in image_paths):
+        return jsonify({'error': 'Missing folder or image_paths list'}), 400
+    
+    try:
+        return jsonify({'comments': get_images_comments(folder, image_paths)})
+    except Exception as e:
+        logger.exception("Error getting comments")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/comments', methods=['POST'])
@@ -1877,7 +4090,7 @@ def save_comment():
         else:
             return jsonify({'error': 'Failed to save comment'}), 500
     except Exception as e:
-        print(f"Error saving comment: {e}")
+        logger.exception("Error saving comment")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/commented_images', methods=['POST'])
@@ -1896,50 +4109,51 @@ def get_commented_images():
         # Load comments
         comments_data = load_comments(folder)
         
+        thumbnail_url = thumbnail_url_format(folder)
+        thumbs_path = Path(folder) / config.INDEX_FOLDER_NAME / 'thumbs'
+        prewarm_thumbnails = thumbs_path.is_dir()
+        
         # Build results for images with comments
         results = []
         for image_path in comments_data.keys():
-            if image_path in image_paths:
-                try:
-                    # Get index position for metadata lookup
-                    idx = image_paths.index(image_path)
-                    
-                    # Create thumbnail
-                    img = Image.open(image_path)
-                    img.thumbnail(config.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                    
-                    # Convert to base64
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=config.THUMBNAIL_QUALITY)
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    # Get metadata if available
-                    metadata_info = {}
-                    if image_metadata and idx < len(image_metadata):
-                        meta = image_metadata[idx]
-                        metadata_info = {
-                            'mtime': meta.get('mtime', 0),
-                            'size': meta.get('size', 0)
-                        }
-                    
-                    results.append({
-                        'path': image_path,
-                        'filename': os.path.basename(image_path),
-                        'thumbnail': img_base64,
-                        'comment_count': len(comments_data[image_path]),
-                        'latest_comment': comments_data[image_path][-1] if comments_data[image_path] else '',
-                        'metadata': metadata_info
-                    })
-                except Exception as img_error:
-                    print(f"Error processing commented image {image_path}: {img_error}")
-                    continue
+            try:
+                # Index position of the path for metadata lookup (a hash table lookup, see PathRows)
+                idx = image_paths.index(image_path)
+            except ValueError:
+                continue
+            try:
+                # Get metadata if available
+                metadata_info = {}
+                meta = image_metadata[idx] if image_metadata and idx < len(image_metadata) else None
+                if meta is not None:
+                    metadata_info = {
+                        'mtime': meta.get('mtime', 0),
+                        'size': meta.get('size', 0)
+                    }
+                
+                # Start missing thumbnails in parallel, as for search results
+                edited = ''
+                if prewarm_thumbnails:
+                    edited = prewarm_thumbnail(image_path, thumbs_path / f'{idx}{THUMBNAIL_EXTENSION}', meta)
+                
+                results.append({
+                    'path': image_path,
+                    'filename': os.path.basename(image_path),
+                    'thumbnail_url': thumbnail_url.format(idx) + edited,
+                    'comment_count': len(comments_data[image_path]),
+                    'latest_comment': comments_data[image_path][-1] if comments_data[image_path] else '',
+                    'metadata': metadata_info
+                })
+            except Exception as img_error:
+                logger.warning("Error processing commented image %s: %s", image_path, img_error)
+                continue
         
         # Sort by most recent comment first
         results.sort(key=lambda x: x['latest_comment'], reverse=True)
         
         return jsonify({'results': results})
     except Exception as e:
-        print(f"Error getting commented images: {e}")
+        logger.exception("Error getting commented images")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/check_index', methods=['POST'])
@@ -1949,8 +4163,48 @@ def check_index():
     if not folder:
         return jsonify({'error': 'No folder specified'}), 400
     
-    index, _, _ = load_index(folder)
-    return jsonify({'indexed': index is not None})
+    # A stat, not a load: the page checks every folder typed into it
+    try:
+        indexed = (Path(folder) / config.INDEX_FOLDER_NAME / 'index.faiss').stat().st_size > 0
+    except OSError:
+        indexed = False
+    with index_jobs_lock:
+        pending = index_cache_key(folder) in index_jobs
+    if indexed and not pending:
+        # Load it in the background meanwhile, so the search that usually follows finds it cached
+        index_load_executor.submit(load_index, folder)
+    return jsonify({'indexed': indexed, 'pending': pending})
+
+def run_index_job(folder):
+    """Create and save the index for a folder; returns the image count (0 if no images)"""
+    index, image_paths, image_metadata, embeddings = create_index(folder)
+    if index is None:
+        return 0
+    if embeddings is None:
+        # The saved index is still current
+        return len(image_paths)
+    
+    save_index(index, image_paths, image_metadata, folder, embeddings)
+    return len(image_paths)
+
+def submit_index_job(folder):
+    """Queue indexing on the single index worker, joining a job already pending for the folder"""
+    key = index_cache_key(folder)
+    with index_jobs_lock:
+        job = index_jobs.get(key)
+        if job is not None:
+            return job
+        job = index_executor.submit(run_index_job, folder)
+        index_jobs[key] = job
+    
+    # Registered outside the lock: the callback runs immediately if the job already finished
+    job.add_done_callback(lambda _: finish_index_job(key))
+    return job
+
+def finish_index_job(key):
+    """Forget a completed indexing job"""
+    with index_jobs_lock:
+        index_jobs.pop(key, None)
 
 @app.route('/index', methods=['POST'])
 def index_folder():
@@ -1960,15 +4214,85 @@ def index_folder():
         return jsonify({'error': 'Invalid folder path'}), 400
     
     try:
-        index, image_paths, image_metadata = create_index(folder)
-        if index is None:
+        # Jobs run one at a time so concurrent requests never share the GPU or index files
+        count = submit_index_job(folder).result()
+        if count == 0:
             return jsonify({'error': 'No images found in folder'}), 400
         
-        save_index(index, image_paths, image_metadata, folder)
-        return jsonify({'success': True, 'count': len(image_paths)})
+        return jsonify({'success': True, 'count': count})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def result_pool_size(k, image_paths, image_metadata, sort_by):
+    """Hits to fetch from FAISS for k results; time sort picks the newest of a larger pool of matches"""
+    if sort_by == 'time' and image_metadata:
+        return min(k * max(config.TIME_SORT_POOL_FACTOR, 1), len(image_paths))
+    return k
+
+def json_line(result):
+    """One NDJSON line as UTF-8 bytes; non-ASCII paths stay raw instead of 6-byte \\uXXXX escapes"""
+    try:
+        if orjson is not None:
+            return orjson.dumps(result, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+        return (json.dumps(result, ensure_ascii=False) + '\n').encode('utf-8')
+    except (UnicodeEncodeError, TypeError):
+        # Undecodable filename (surrogateescape): the escaped form round-trips through the browser
+        return (json.dumps(result) + '\n').encode('ascii')
+
+def search_hits(similarities, indices, count):
+    """(row, similarity) pairs of a search's valid hits as plain Python numbers, masked and converted in one pass"""
+    rows, similarities = indices[0], similarities[0]
+    valid = (rows >= 0) & (rows < count)  # -1 pads short result lists
+    return list(zip(rows[valid].tolist(), similarities[valid].tolist()))
+
+def stream_results(folder, hits, image_paths, image_metadata, sort_by, limit):
+    """Stream the top limit search hits as NDJSON, one line per result; thumbnails load separately from /thumb"""
+    thumbnail_url = thumbnail_url_format(folder)
+    thumbs_path = Path(folder) / config.INDEX_FOLDER_NAME / 'thumbs'
+    prewarm_thumbnails = thumbs_path.is_dir()
+    
+    # Sort results based on sort_by parameter
+    if sort_by == 'time' and image_metadata:
+        # Sort by modification time (newest first); only metadata is needed, so lines can still stream.
+        # A stable argsort of the negated times keeps similarity order among equal times, like sorted(reverse=True)
+        rows = np.fromiter((hit[0] for hit in hits), dtype=np.int64, count=len(hits))
+        mtimes = metadata_values(image_metadata, rows, 'mtime')
+        hits = [hits[i] for i in np.argsort(-mtimes, kind='stable')]
+    # Otherwise keep similarity sort (default FAISS order)
+    hits = hits[:limit]  # only the results sent get a thumbnail job
+    
+    def generate():
+        # Each line is sent as soon as it is built rather than after the whole result list
+        for idx, sim in hits:
+            # Get metadata if available
+            metadata_info = {}
+            meta = image_metadata[idx] if image_metadata and idx < len(image_metadata) else None
+            if meta is not None:
+                metadata_info = {
+                    'mtime': meta.get('mtime', 0),
+                    'size': meta.get('size', 0)
+                }
+            
+            img_path = image_paths[idx]
+            result = {
+                'path': img_path,
+                'filename': os.path.basename(img_path),
+                'similarity': sim,
+                'thumbnail_url': thumbnail_url.format(idx),
+                'metadata': metadata_info
+            }
+            
+            # Near-duplicates are not in FAISS; surface them with their original
+            if meta is not None and meta.get('duplicates'):
+                result['duplicates'] = [image_paths[row] for row in meta['duplicates']]
+            
+            # Start any missing thumbnail now; /thumb waits for it instead of encoding on request
+            if prewarm_thumbnails:
+                result['thumbnail_url'] += prewarm_thumbnail(img_path, thumbs_path / f'{idx}{THUMBNAIL_EXTENSION}', meta)
+            yield json_line(result)
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
 @app.route('/search', methods=['POST'])
 def search():
     """Search for images"""
@@ -1976,7 +4300,7 @@ def search():
     query = request.json.get('query')
     limit = request.json.get('limit', 10)
     sort_by = request.json.get('sort_by', 'similarity')  # 'similarity' or 'time'
-    print(f"Search request: folder={folder}, query={query}, limit={limit}, sort_by={sort_by}")
+    logger.debug("Search request: folder=%s query=%s limit=%s sort_by=%s", folder, query, limit, sort_by)
     
     if not folder or not query:
         return jsonify({'error': 'Missing folder or query'}), 400
@@ -2001,57 +4325,21 @@ def search():
         # Search
         k = min(limit, len(image_paths))
         if k == 0:
-            return jsonify({'results': []})
-        similarities, indices = index.search(text_embedding.reshape(1, -1), k)
-        
-        results = []
-        for i, (idx, sim) in enumerate(zip(indices[0], similarities[0])):
-            if idx >= 0 and idx < len(image_paths):
-                try:
-                    img_path = image_paths[idx]
-                    
-                    # Create thumbnail
-                    img = Image.open(img_path)
-                    img.thumbnail(config.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                    
-                    # Convert to base64
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=config.THUMBNAIL_QUALITY)
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    # Get metadata if available
-                    metadata_info = {}
-                    if image_metadata and idx < len(image_metadata):
-                        meta = image_metadata[idx]
-                        metadata_info = {
-                            'mtime': meta.get('mtime', 0),
-                            'size': meta.get('size', 0)
-                        }
-                    
-                    results.append({
-                        'path': img_path,
-                        'filename': os.path.basename(img_path),
-                        'similarity': float(sim),
-                        'thumbnail': img_base64,
-                        'metadata': metadata_info
-                    })
-                except Exception as img_error:
-                    print(f"Error processing image {img_path}: {img_error}")
-                    continue
-        
-        # Sort results based on sort_by parameter
-        if sort_by == 'time' and image_metadata:
-            # Sort by modification time (newest first)
-            results.sort(key=lambda x: x['metadata'].get('mtime', 0), reverse=True)
-        # Otherwise keep similarity sort (default FAISS order)
+            return Response('', mimetype='application/x-ndjson')
+        similarities, indices = search_index(index, text_embedding, result_pool_size(k, image_paths, image_metadata, sort_by),
+                                             load_embeddings(folder))
         
-        return jsonify({'results': results})
+        hits = search_hits(similarities, indices, len(image_paths))
+        return stream_results(folder, hits, image_paths, image_metadata, sort_by, k)
     except Exception as e:
-        print(f"Text search error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Text search error")
         return jsonify({'error': str(e)}), 500
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    """JSON error for requests over MAX_FILE_SIZE_MB, which the frontend shows like other errors"""
+    return jsonify({'error': f'Upload larger than {config.MAX_FILE_SIZE_MB} MB'}), 413
+
 @app.route('/search_by_image', methods=['POST'])
 def search_by_image():
     """Search for images using an uploaded image"""
@@ -2088,75 +4376,50 @@ def search_by_image():
     try:
         # Process image from either file upload or path
         if file:
-            # Process uploaded image
+            # Process uploaded image; Werkzeug spools large uploads to a temp file, PIL reads it from there
             uploaded_image = Image.open(file.stream)
+            # Decode large JPEGs at a reduced scale, like indexed images: a full-size decode of a 50 MB photo is several times the upload
+            resolution = model.visual.input_resolution
+            uploaded_image.draft('RGB', (resolution, resolution))
             if uploaded_image.mode != 'RGB':
                 uploaded_image = uploaded_image.convert('RGB')
             # Get image embedding
             image_embedding = get_image_embedding_from_pil(uploaded_image)
         else:
-            # Process image from path
-            if not os.path.exists(image_path):
+            # Process image from path; "Find similar" on an indexed image reuses its saved embedding
+            # (the lookup's stat also tells whether the file exists, so a hit costs one stat)
+            image_embedding = get_indexed_embedding(folder, image_paths, image_metadata, image_path)
+            if image_embedding is None and not os.path.exists(image_path):
                 return jsonify({'error': f'Image file not found: {image_path}'}), 400
             
             try:
-                # Get image embedding directly from path
-                image_embedding = get_image_embedding(image_path)
+                if image_embedding is None:
+                    image_embedding = get_image_embedding(image_path)
             except Exception as path_error:
+                logger.warning("Error processing query image %s: %s", image_path, path_error)
                 return jsonify({'error': f'Error processing image from path: {str(path_error)}'}), 400
         
         # Search
         k = min(limit, len(image_paths))
         if k == 0:
-            return jsonify({'results': []})
-        similarities, indices = index.search(image_embedding.reshape(1, -1), k)
-        
-        results = []
-        for i, (idx, sim) in enumerate(zip(indices[0], similarities[0])):
-            if idx >= 0 and idx < len(image_paths):
-                try:
-                    img_path = image_paths[idx]
-                    
-                    # Create thumbnail
-                    img = Image.open(img_path)
-                    img.thumbnail(config.THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-                    
-                    # Convert to base64
-                    buffer = BytesIO()
-                    img.save(buffer, format='JPEG', quality=config.THUMBNAIL_QUALITY)
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    # Get metadata if available
-                    metadata_info = {}
-                    if image_metadata and idx < len(image_metadata):
-                        meta = image_metadata[idx]
-                        metadata_info = {
-                            'mtime': meta.get('mtime', 0),
-                            'size': meta.get('size', 0)
-                        }
-                    
-                    results.append({
-                        'path': img_path,
-                        'filename': os.path.basename(img_path),
-                        'similarity': float(sim),
-                        'thumbnail': img_base64,
-                        'metadata': metadata_info
-                    })
-                except Exception as img_error:
-                    print(f"Error processing image {img_path}: {img_error}")
-                    continue
-        
-        # Sort results based on sort_by parameter
-        if sort_by == 'time' and image_metadata:
-            # Sort by modification time (newest first)
-            results.sort(key=lambda x: x['metadata'].get('mtime', 0), reverse=True)
-        # Otherwise keep similarity sort (default FAISS order)
+            return Response('', mimetype='application/x-ndjson')
+        similarities, indices = search_index(index, image_embedding, result_pool_size(k, image_paths, image_metadata, sort_by),
+                                             load_embeddings(folder))
         
-        return jsonify({'results': results})
+        hits = search_hits(similarities, indices, len(image_paths))
+        return stream_results(folder, hits, image_paths, image_metadata, sort_by, k)
     except Exception as e:
+        logger.exception("Image search error")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/search_cache_clear', methods=['POST'])
+def search_cache_clear():
+    """Drop cached text query embeddings (e.g. after swapping model weights)"""
+    cleared = encode_text_query.cache_info().currsize
+    encode_text_query.cache_clear()
+    return jsonify({'success': True, 'cleared': cleared})
+
 @app.route('/settings', methods=['GET'])
 def get_settings():
     """Get current configuration settings"""
@@ -2166,6 +4429,7 @@ def get_settings():
             'port': config.PORT,
             'debug': config.DEBUG,
             'clipModel': config.CLIP_MODEL,
+            'clipDevice': config.CLIP_DEVICE,
             'minResults': config.MIN_RESULTS,
             'maxResults': config.MAX_RESULTS,
             'defaultResults': config.DEFAULT_RESULTS,
@@ -2208,6 +4472,9 @@ def save_settings():
                 
             if not (min_results <= default_results <= max_results):
                 return jsonify({'success': False, 'error': 'Default results must be between min and max results'}), 400
+            
+            if data.get('clipDevice', 'auto') not in ('auto', 'cuda', 'cpu'):
+                return jsonify({'success': False, 'error': 'CLIP device must be auto, cuda or cpu'}), 400
                 
         except ValueError as e:
             return jsonify({'success': False, 'error': f'Invalid number format: {str(e)}'}), 400
@@ -2223,6 +4490,7 @@ EVOSSEARCH_DEBUG={str(data['debug']).lower()}
 
 # CLIP model configuration
 EVOSSEARCH_CLIP_MODEL={data['clipModel']}
+EVOSSEARCH_CLIP_DEVICE={data.get('clipDevice', 'auto')}
 
 # Search result limits
 EVOSSEARCH_MIN_RESULTS={data['minResults']}
@@ -2252,7 +4520,24 @@ EVOSSEARCH_MAX_FILE_SIZE_MB={data.get('maxFileSize', 50)}
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def image_codec_info():
+    """Which image libraries decode and resize, for the startup banner (Pillow-SIMD versions end in .postN)"""
+    pillow = f"Pillow-SIMD {PIL.__version__}" if '.post' in PIL.__version__ else f"Pillow {PIL.__version__}"
+    try:
+        libjpeg = 'libjpeg-turbo' if pil_features.check_feature('libjpeg_turbo') else 'libjpeg'
+    except Exception:
+        libjpeg = 'libjpeg'
+    jpeg = 'PyTurboJPEG' if turbo_jpeg is not None else f'{pillow} ({libjpeg})'
+    return f"JPEG decoding: {jpeg}; resizing: {pillow}"
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG if config.DEBUG else logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     init_clip()
+    print(image_codec_info())
     config.print_startup_info()
-    app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
+    if waitress is not None and not config.DEBUG:
+        # One process, many threads: the CLIP model, loaded indexes, caches and batching queues are shared
+        # by every request, which is what lets concurrent searches batch (worker processes would each load CLIP)
+        waitress.serve(app, host=config.HOST, port=config.PORT, threads=config.SERVER_THREADS)
+    else:
+        app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG, threaded=True)
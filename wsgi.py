@@ -0,0 +1,8 @@
+"""
+WSGI entry point for evo-ssearch, e.g. gunicorn -w 1 -k gthread --threads 16 wsgi:application
+Keep a single worker process: the CLIP model, loaded indexes and search batching live in it
+"""
+from oldapp import app, init_clip
+
+init_clip()
+application = app